@@ -1,6 +1,13 @@
 """TrouveUnCadeau FastAPI Application Package"""
 
-from .main import app
-
 __version__ = "1.0.0"
 __all__ = ["app"]
+
+
+def __getattr__(name):
+    # Import the FastAPI app on first access only, so `app.services` and
+    # `app.core` can be used without pulling in main's LLM dependencies.
+    if name == "app":
+        from .main import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
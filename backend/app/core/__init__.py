@@ -1,6 +1,6 @@
 """Core configuration and utilities"""
 
-from .config import Config
+from .config import Settings, settings, get_settings
 from .exceptions import (
     TrouveUnCadeauException,
     ValidationError,
@@ -16,11 +16,13 @@ from .schemas import (
     ProductBase,
     Product,
     ProductsResponse,
+    SearchResponse,
     RecommendationRequest,
     RecommendationItem,
     RecommendationsResponse,
     HealthStatus,
     ServiceHealth,
+    CatalogChangeNotification,
     ErrorResponse,
     PaginationParams,
     APIInfo,
@@ -58,7 +60,9 @@ from .utils import (
 )
 
 __all__ = [
-    "Config",
+    "Settings",
+    "settings",
+    "get_settings",
     "TrouveUnCadeauException",
     "ValidationError",
     "NotFoundError",
@@ -71,11 +75,13 @@ __all__ = [
     "ProductBase",
     "Product",
     "ProductsResponse",
+    "SearchResponse",
     "RecommendationRequest",
     "RecommendationItem",
     "RecommendationsResponse",
     "HealthStatus",
     "ServiceHealth",
+    "CatalogChangeNotification",
     "ErrorResponse",
     "PaginationParams",
     "APIInfo",
@@ -3,6 +3,7 @@
 from typing import Any, Dict, Optional, Callable
 from datetime import datetime, timedelta
 from functools import wraps
+import asyncio
 import json
 import logging
 import hashlib
@@ -93,6 +94,31 @@ class CacheKey:
         return f"search:{query.lower()}"
 
 
+def make_etag(content_hash: str, *parts: Any) -> str:
+    """Strong ETag for a response derived from catalog content and request parts."""
+    key = "|".join([content_hash, *(str(part) for part in parts)])
+    return '"%s"' % hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True when an If-None-Match header matches etag (weak comparison).
+    
+    Proxies that compress the body (nginx gzip) downgrade the ETag to a
+    weak one, so a `W/` prefix is ignored.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
 def cache_result(ttl_seconds: int = 3600, cache_obj: Optional[InMemoryCache] = None):
     """Decorator for caching function results."""
     def decorator(func: Callable) -> Callable:
@@ -149,6 +175,61 @@ def cache_result(ttl_seconds: int = 3600, cache_obj: Optional[InMemoryCache] = N
     return decorator
 
 
+class SingleFlight:
+    """Coalesce concurrent async calls sharing a key into one execution.
+    
+    The first caller for a key starts the work; callers arriving while it
+    is in flight await the same task instead of starting their own.
+    """
+    
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.coalesced_by_key: Dict[str, int] = {}
+    
+    def submit(self, key: str, func: Callable, *args, **kwargs) -> asyncio.Task:
+        """Return the in-flight task for key, starting func if there is none."""
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            self.coalesced_by_key[key] = self.coalesced_by_key.get(key, 0) + 1
+            logger.debug(f"Single-flight coalesced: {key}")
+            return task
+        
+        self.executions += 1
+        task = asyncio.create_task(func(*args, **kwargs))
+        self._in_flight[key] = task
+        
+        def _forget(done: asyncio.Task):
+            if self._in_flight.get(key) is done:
+                del self._in_flight[key]
+        
+        task.add_done_callback(_forget)
+        return task
+    
+    async def do(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        """Await the shared result; a cancelled caller does not cancel the others."""
+        return await asyncio.shield(self.submit(key, func, *args, **kwargs))
+    
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        """Return the in-flight task for key, if any."""
+        task = self._in_flight.get(key)
+        return task if task is not None and not task.done() else None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics."""
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'coalesced_by_key': dict(self.coalesced_by_key),
+            'in_flight': sorted(key for key, task in self._in_flight.items() if not task.done())
+        }
+
+
 # Global cache instance
 _cache = InMemoryCache()
 
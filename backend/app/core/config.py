@@ -22,6 +22,36 @@ class Settings(BaseSettings):
     AIRTABLE_API_KEY: str = os.getenv("AIRTABLE_API_KEY", "")
     AIRTABLE_BASE_ID: str = os.getenv("AIRTABLE_BASE_ID", "appw9JQ4PA66Tryh5")
     AIRTABLE_TABLE_ID: str = os.getenv("AIRTABLE_TABLE_ID", "tblgO4MsNTLEhgJHo")
+    # URL complète de la table, pour pointer vers l'émulateur local (tests/airtable_emulator.py)
+    AIRTABLE_BASE_URL: str = os.getenv("AIRTABLE_BASE_URL", "")
+    
+    # Airtable HTTP client (pool partagé)
+    AIRTABLE_MAX_CONNECTIONS: int = int(os.getenv("AIRTABLE_MAX_CONNECTIONS", 20))
+    AIRTABLE_MAX_KEEPALIVE: int = int(os.getenv("AIRTABLE_MAX_KEEPALIVE", 10))
+    AIRTABLE_KEEPALIVE_EXPIRY: float = float(os.getenv("AIRTABLE_KEEPALIVE_EXPIRY", 30.0))
+    AIRTABLE_HTTP2: bool = os.getenv("AIRTABLE_HTTP2", "true").lower() == "true"
+    AIRTABLE_CONNECT_TIMEOUT: float = float(os.getenv("AIRTABLE_CONNECT_TIMEOUT", 5.0))
+    AIRTABLE_READ_TIMEOUT: float = float(os.getenv("AIRTABLE_READ_TIMEOUT", 15.0))
+    AIRTABLE_WRITE_TIMEOUT: float = float(os.getenv("AIRTABLE_WRITE_TIMEOUT", 10.0))
+    AIRTABLE_POOL_TIMEOUT: float = float(os.getenv("AIRTABLE_POOL_TIMEOUT", 5.0))
+    
+    # Airtable throttling (~5 requêtes/seconde par base)
+    AIRTABLE_RATE_LIMIT: float = float(os.getenv("AIRTABLE_RATE_LIMIT", 5.0))
+    AIRTABLE_BURST: int = int(os.getenv("AIRTABLE_BURST", 5))
+    AIRTABLE_MAX_RETRIES: int = int(os.getenv("AIRTABLE_MAX_RETRIES", 4))
+    AIRTABLE_BACKOFF_BASE: float = float(os.getenv("AIRTABLE_BACKOFF_BASE", 0.5))
+    AIRTABLE_BACKOFF_MAX: float = float(os.getenv("AIRTABLE_BACKOFF_MAX", 30.0))
+    
+    # Catalogue local (miroir SQLite synchronisé depuis Airtable)
+    CATALOG_DB_PATH: str = os.getenv("CATALOG_DB_PATH", "data/catalog.sqlite3")
+    CATALOG_SYNC_INTERVAL: float = float(os.getenv("CATALOG_SYNC_INTERVAL", 300.0))
+    CATALOG_RECONCILE_INTERVAL: float = float(os.getenv("CATALOG_RECONCILE_INTERVAL", 3600.0))
+    CATALOG_REFRESH_RETRY_INTERVAL: float = float(os.getenv("CATALOG_REFRESH_RETRY_INTERVAL", 30.0))
+    # Colonnes Airtable synchronisées, séparées par des virgules (ex. "Name,Price,Category,Tags");
+    # vide = ProductFields.CATALOG
+    CATALOG_FIELDS: str = os.getenv("CATALOG_FIELDS", "")
+    # Secret partagé avec n8n pour POST /api/internal/catalog-changed (vide = désactivé)
+    CATALOG_WEBHOOK_SECRET: str = os.getenv("CATALOG_WEBHOOK_SECRET", "")
     
     # OpenAI (GPT)
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
@@ -57,3 +87,6 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     """Get cached settings instance"""
     return Settings()
+
+
+settings = get_settings()
@@ -1,10 +1,14 @@
 """Rate limiting and throttling for API protection."""
 
-from typing import Dict, Optional
+from typing import Dict, Optional, List, Tuple, Any
 from datetime import datetime, timedelta
 from collections import defaultdict
+import asyncio
 import hashlib
+import heapq
+import itertools
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -136,6 +140,156 @@ class AdaptiveRateLimiter:
         return self.base_limiter.is_allowed(identifier, adjusted_limit)
 
 
+class TokenBucket:
+    """Token bucket for client-side throttling of outbound calls."""
+    
+    def __init__(self, rate: float, capacity: int):
+        """
+        Initialize token bucket.
+        
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum burst size
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def time_until_available(self, tokens: float = 1) -> float:
+        """Seconds to wait before `tokens` can be consumed."""
+        self._refill()
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        missing = max(0.0, tokens - self.tokens)
+        return max(blocked, missing / self.rate)
+    
+    def try_consume(self, tokens: float = 1) -> bool:
+        """Consume tokens if available right now."""
+        if self.time_until_available(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+    
+    def block_for(self, seconds: float):
+        """Stop handing out tokens for `seconds` (e.g. after a 429) and drain the bucket."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class RequestPriority:
+    """Dispatch priorities for outbound calls (lower is served first)."""
+    
+    INTERACTIVE = 0  # User-facing reads (search)
+    WRITE = 1  # Writes to the upstream API
+    BACKGROUND = 2  # Catalog refresh and reconciliation
+    
+    NAMES = {INTERACTIVE: "interactive", WRITE: "write", BACKGROUND: "background"}
+
+
+class OutboundRequestScheduler:
+    """Priority queue in front of a token bucket for calls to a rate-limited API.
+    
+    Callers await `acquire()` before each request. A single dispatcher hands
+    out tokens in priority order, so background work never delays an
+    interactive call that is already waiting.
+    """
+    
+    def __init__(self, rate: float = 5.0, burst: int = 5):
+        self.bucket = TokenBucket(rate, burst)
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.dispatched: Dict[int, int] = defaultdict(int)
+        self.total_wait: Dict[int, float] = defaultdict(float)
+        self.max_wait: Dict[int, float] = defaultdict(float)
+    
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+    
+    async def _dispatch(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            delay = self.bucket.time_until_available()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue  # Waiter was cancelled
+            self.bucket.try_consume()
+            future.set_result(None)
+    
+    async def acquire(self, priority: int = RequestPriority.INTERACTIVE) -> float:
+        """Wait for a token, returns the time spent queued in seconds."""
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._wakeup.set()
+        
+        await future
+        
+        waited = time.monotonic() - enqueued
+        self.dispatched[priority] += 1
+        self.total_wait[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+        return waited
+    
+    def pause(self, seconds: float):
+        """Hold every queued call for `seconds` (upstream asked us to back off)."""
+        self.bucket.block_for(seconds)
+        logger.warning(f"Outbound calls paused for {seconds:.1f}s")
+    
+    async def close(self):
+        """Stop the dispatcher."""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        self._dispatcher = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and wait-time metrics per priority."""
+        depth: Dict[str, int] = defaultdict(int)
+        for priority, _, future in self._queue:
+            if not future.done():
+                depth[RequestPriority.NAMES.get(priority, str(priority))] += 1
+        
+        priorities = {}
+        for priority, count in self.dispatched.items():
+            priorities[RequestPriority.NAMES.get(priority, str(priority))] = {
+                "dispatched": count,
+                "avg_wait_ms": round(self.total_wait[priority] / count * 1000, 2),
+                "max_wait_ms": round(self.max_wait[priority] * 1000, 2),
+            }
+        
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": dict(depth),
+            "priorities": priorities,
+            "rate_per_second": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "paused_for_seconds": round(max(0.0, self.bucket.blocked_until - time.monotonic()), 2),
+        }
+
+
 def get_client_ip(request) -> str:
     """Extract client IP from request, accounting for proxies."""
     # Check X-Forwarded-For header first (behind proxy)
@@ -39,6 +39,20 @@ class ProductsResponse(BaseModel):
     products: List[Product] = Field(default_factory=list, description="Liste des produits")
 
 
+class SearchResponse(BaseModel):
+    """Réponse pour l'endpoint GET /api/search"""
+    status: str = Field("success", description="Statut de la requête")
+    total: int = Field(..., ge=0, description="Nombre total de résultats")
+    skip: int = Field(0, ge=0, description="Résultats sautés")
+    limit: int = Field(20, ge=1, description="Taille de la page")
+    items: List[Dict[str, Any]] = Field(default_factory=list, description="Produits de la page")
+    did_you_mean: Optional[str] = Field(None, description="Requête corrigée, si des mots ont été corrigés")
+    corrections: Dict[str, str] = Field(default_factory=dict, description="Mot saisi -> correction")
+    facets: Optional[Dict[str, List[Dict[str, Any]]]] = Field(
+        None, description="Nombre de résultats par catégorie, tranche de prix et étiquette (si demandé)"
+    )
+
+
 # ============ RECOMMANDATIONS ============
 
 class RecommendationRequest(BaseModel):
@@ -91,6 +105,14 @@ class ServiceHealth(BaseModel):
     uptime_seconds: Optional[float] = Field(None, description="Temps depuis le démarrage")
 
 
+# ============ INTERNE ============
+
+class CatalogChangeNotification(BaseModel):
+    """Notification n8n: enregistrements Airtable modifiés ou supprimés"""
+    record_ids: List[str] = Field(default_factory=list, max_length=1000, description="IDs Airtable modifiés ou créés")
+    deleted_ids: List[str] = Field(default_factory=list, max_length=1000, description="IDs Airtable supprimés")
+
+
 # ============ ERREURS ============
 
 class ErrorResponse(BaseModel):
@@ -1,8 +1,11 @@
 """Utility functions for the application."""
 
 import re
+import sys
 import hashlib
-from typing import Dict, List, Any, Optional
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Sequence
 from datetime import datetime
 import logging
 
@@ -27,28 +30,65 @@ def sanitize_string(value: str, max_length: Optional[int] = None) -> str:
     return sanitized
 
 
+# Letters that do not decompose into base letter + accent
+_LIGATURES = {
+    'œ': 'oe', 'æ': 'ae', 'ß': 'ss', 'ø': 'o', 'đ': 'd', 'ð': 'd',
+    'ł': 'l', 'ħ': 'h', 'ı': 'i', 'þ': 'th', 'ŀ': 'l',
+}
+
+# Strings up to this length are memoized (categories, tags, query terms)
+NORMALIZE_MEMO_MAX_LENGTH = 64
+
+
+def _build_diacritic_table() -> Dict[str, str]:
+    """Accented lowercase Latin letter -> ASCII, combining mark -> removed."""
+    table = dict(_LIGATURES)
+    for code in range(0x00C0, 0x0250):
+        char = chr(code)
+        if char != char.lower() or char in table:
+            continue
+        base = ''.join(c for c in unicodedata.normalize('NFKD', char) if not unicodedata.combining(c))
+        if base != char and base.isascii():
+            table[char] = base
+    # Combining accents left by lower() (e.g. 'İ') or decomposed input
+    for code in range(0x0300, 0x0370):
+        table[chr(code)] = ''
+    return table
+
+
+_DIACRITIC_TABLE = _build_diacritic_table()
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().strip()
+    if text.isascii():
+        return text
+    # One regex pass finds the non-ASCII characters; each distinct one is
+    # then replaced from the table (str.translate is per-character Python
+    # work, much slower on long descriptions)
+    for char in set(_NON_ASCII.findall(text)):
+        replacement = _DIACRITIC_TABLE.get(char)
+        if replacement is not None:
+            text = text.replace(char, replacement)
+    return text
+
+
+_normalize_memo = lru_cache(maxsize=8192)(_normalize)
+
+
 def normalize_text(text: str) -> str:
-    """Normalize text for comparison (lowercase, remove diacritics)."""
+    """Normalize text for comparison (lowercase, remove diacritics).
+    
+    Table-driven (built from unicodedata) and covering French and
+    Québécois letters (é, è, à, ç, œ, æ, ÿ...); ASCII text takes a fast
+    path and short strings are memoized.
+    """
     if not isinstance(text, str):
         return ""
-    
-    text = text.lower().strip()
-    
-    # Simple diacritic removal for French characters
-    diacritic_map = {
-        'à': 'a', 'â': 'a', 'ä': 'a',
-        'é': 'e', 'è': 'e', 'ê': 'e', 'ë': 'e',
-        'î': 'i', 'ï': 'i',
-        'ô': 'o', 'ö': 'o',
-        'ù': 'u', 'û': 'u', 'ü': 'u',
-        'ç': 'c',
-        'ñ': 'n'
-    }
-    
-    for char, replacement in diacritic_map.items():
-        text = text.replace(char, replacement)
-    
-    return text
+    if len(text) <= NORMALIZE_MEMO_MAX_LENGTH:
+        return _normalize_memo(text)
+    return _normalize(text)
 
 
 def generate_hash(data: str) -> str:
@@ -159,6 +199,31 @@ def log_performance(func_name: str, duration_ms: float, threshold_ms: float = 10
         logger.debug(f"Performance: {func_name} took {duration_ms:.2f}ms")
 
 
+def _sizeof_members(members: Sequence[Any], sample: int) -> int:
+    getsizeof = sys.getsizeof
+    if len(members) <= sample:
+        return sum(map(getsizeof, members))
+    picked = members[::len(members) // sample]
+    return sum(map(getsizeof, picked)) * len(members) // len(picked)
+
+
+def sizeof_items(container: Any, keys: bool = True, sample: int = 1024) -> int:
+    """Approximate footprint in bytes of a container and its direct items (dict keys and values), not recursing further.
+    
+    Above `sample` items, evenly spaced items are measured and their size extrapolated.
+    """
+    size = sys.getsizeof(container)
+    if isinstance(container, dict):
+        if keys:
+            size += _sizeof_members(list(container), sample)
+        size += _sizeof_members(list(container.values()), sample)
+    elif isinstance(container, (list, tuple)):
+        size += _sizeof_members(container, sample)
+    elif isinstance(container, (set, frozenset)):
+        size += _sizeof_members(list(container), sample)
+    return size
+
+
 def is_valid_email(email: str) -> bool:
     """Validate email address format."""
     email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -4,16 +4,19 @@ Moteur de recommandation de cadeaux intelligents pour Québec
 Utilise LangChain pour l'intégration IA et Airtable pour la base de données produits.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.core import configure_middleware
 from dotenv import load_dotenv
 import os
+import hmac
+import asyncio
+import heapq
+import httpx
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
-from app.core.rate_limiter import rate_limit
-from app.core.cache import cache_response
+from app.core.cache import make_etag, etag_matches
 
 # Configuration du logging
 logging.basicConfig(
@@ -48,19 +51,105 @@ app.add_middleware(
 
 # Importer les services
 from app.services.airtable_service import AirtableService
+from app.services.catalog_store import CatalogStore, ProductFields
 from app.services.recommendation_engine import RecommendationEngine
+from app.services.search_engine import get_search_engine, SEARCH_FIELDS
 from app.core.config import settings
+from app.core.schemas import SearchResponse, CatalogChangeNotification
+from app.core.validators import validate_pagination
 
 # Initialiser les services
 airtable_service = None
 recommendation_engine = None
+compaction_task = None
+
+# Les réponses du catalogue sont revalidées à chaque fois (304 si rien n'a changé)
+CATALOG_CACHE_CONTROL = "no-cache"
+
+# Nombre de produits candidats envoyés au LLM (RecommendationEngine n'en lit que 10)
+RECOMMENDATION_CANDIDATES = 10
+
+
+def catalog_etag(store, request: Request) -> str:
+    """ETag d'une réponse du catalogue: hash du contenu + chemin + paramètres"""
+    return make_etag(store.content_hash, request.url.path, sorted(request.query_params.multi_items()))
+
+
+async def get_search_store():
+    """Catalogue de la génération publiée du moteur de recherche (indexé une fois par version)"""
+    store = await airtable_service.get_product_store()
+    search_engine = get_search_engine()
+    generation = search_engine.generation
+    if generation is None or generation.store is not store:
+        # Nouvelle version: indexer hors de la boucle d'événements
+        generation = await asyncio.to_thread(search_engine.use, store)
+    
+    # Compacter en arrière-plan un catalogue mis à jour par deltas (tombstones, statistiques)
+    global compaction_task
+    if generation.store.needs_compaction() and (compaction_task is None or compaction_task.done()):
+        compaction_task = asyncio.create_task(compact_search_store(generation.store))
+    return generation.store
+
+
+async def compact_search_store(store):
+    """Reconstruire le catalogue sans tombstones hors de la boucle, puis l'adopter"""
+    try:
+        generation = await asyncio.to_thread(get_search_engine().compact, store)
+        if generation is not None:
+            airtable_service.replace_product_store(store, generation.store)
+    except Exception as e:
+        logger.error(f"Compaction error: {str(e)}")
+
+
+def check_not_modified(store, request: Request, response: Response) -> Optional[Response]:
+    """Retourner un 304 si le client a déjà cette version, sinon poser l'ETag sur la réponse"""
+    etag = catalog_etag(store, request)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CATALOG_CACHE_CONTROL
+    return None
 
 @app.on_event("startup")
 async def startup_event():
     """Initialiser les services au démarrage"""
     global airtable_service, recommendation_engine
     try:
-        airtable_service = AirtableService()
+        airtable_service = AirtableService(
+            api_key=settings.AIRTABLE_API_KEY,
+            base_id=settings.AIRTABLE_BASE_ID,
+            table_id=settings.AIRTABLE_TABLE_ID,
+            base_url=settings.AIRTABLE_BASE_URL or None,
+            max_connections=settings.AIRTABLE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AIRTABLE_MAX_KEEPALIVE,
+            keepalive_expiry=settings.AIRTABLE_KEEPALIVE_EXPIRY,
+            http2=settings.AIRTABLE_HTTP2,
+            timeout=httpx.Timeout(
+                connect=settings.AIRTABLE_CONNECT_TIMEOUT,
+                read=settings.AIRTABLE_READ_TIMEOUT,
+                write=settings.AIRTABLE_WRITE_TIMEOUT,
+                pool=settings.AIRTABLE_POOL_TIMEOUT
+            ),
+            catalog=CatalogStore(settings.CATALOG_DB_PATH),
+            sync_interval=settings.CATALOG_SYNC_INTERVAL,
+            reconcile_interval=settings.CATALOG_RECONCILE_INTERVAL,
+            refresh_retry_interval=settings.CATALOG_REFRESH_RETRY_INTERVAL,
+            catalog_fields=(
+                [field.strip() for field in settings.CATALOG_FIELDS.split(",") if field.strip()]
+                or ProductFields.CATALOG
+            ),
+            rate_limit=settings.AIRTABLE_RATE_LIMIT,
+            burst=settings.AIRTABLE_BURST,
+            max_retries=settings.AIRTABLE_MAX_RETRIES,
+            backoff_base=settings.AIRTABLE_BACKOFF_BASE,
+            backoff_max=settings.AIRTABLE_BACKOFF_MAX
+        )
+        # Servir immédiatement le dernier snapshot local, sans attendre Airtable
+        airtable_service.load_catalog()
+        await airtable_service.start()
+        airtable_service.start_refresher()
+        # Indexer le catalogue avant la première recherche
+        await get_search_store()
         recommendation_engine = RecommendationEngine()
         logger.info("✅ Services initialized successfully")
     except Exception as e:
@@ -71,6 +160,10 @@ async def startup_event():
 async def shutdown_event():
     """Nettoyer les ressources à l'arrêt"""
     logger.info("🛑 Shutting down application")
+    if airtable_service is not None:
+        await airtable_service.stop_refresher()
+        await airtable_service.close()
+        airtable_service.catalog.close()
 
 # ============ ENDPOINTS SANTE ============
 
@@ -87,7 +180,6 @@ async def root():
         }
     }
 
-@rate_limit(max_requests=200, window_seconds=60)
 @app.get("/health", tags=["Health"])
 async def health():
     """Vérifier la santé du service"""
@@ -97,18 +189,23 @@ async def health():
         "version": "1.0.0"
     }
 
-@rate_limit(max_requests=200, window_seconds=60)
 @app.get("/api/health", tags=["Health"])
 async def api_health():
     """Vérifier la santé complète du service"""
     services_status = {}
     
-    # Vérifier Airtable
-    try:
-        await airtable_service.get_all_products()
+    # Vérifier le catalogue (servi localement, rafraîchi en arrière-plan)
+    catalog_status = airtable_service.get_catalog_status()
+    if catalog_status["last_error"]:
+        services_status["airtable"] = f"❌ error: {catalog_status['last_error']}"
+    else:
         services_status["airtable"] = "✅ connected"
-    except Exception as e:
-        services_status["airtable"] = f"❌ error: {str(e)}"
+    services_status["catalog"] = catalog_status
+    
+    services_status["airtable_pool"] = airtable_service.get_pool_stats()
+    services_status["airtable_coalescing"] = airtable_service.get_coalescing_stats()
+    services_status["airtable_scheduler"] = airtable_service.get_scheduler_stats()
+    services_status["search"] = get_search_engine().get_stats()
     
     # Vérifier les modèles IA
     try:
@@ -124,10 +221,10 @@ async def api_health():
 
 # ============ ENDPOINTS API ============
 
-@rate_limit(max_requests=60, window_seconds=60)
-@cache_response(ttl_seconds=1800)  # 30 minutes
 @app.get("/api/products", tags=["Products"])
 async def get_products(
+    request: Request,
+    response: Response,
     limit: int = 100,
     category: str = None
 ) -> Dict[str, Any]:
@@ -135,13 +232,19 @@ async def get_products(
     try:
         logger.info(f"📦 Fetching products (limit={limit}, category={category})")
         
-        products = await airtable_service.get_all_products()
+        store = await airtable_service.get_product_store()
+        not_modified = check_not_modified(store, request, response)
+        if not_modified is not None:
+            return not_modified
         
-        if category:
-            products = [p for p in products if p.get('Category', '').lower() == category.lower()]
+        # Index catégorie -> produits, reconstruit seulement quand le catalogue change
+        ordinals = store.category_postings(category) if category else store.all_ordinals()
         
         if limit:
-            products = products[:limit]
+            ordinals = ordinals[:limit]
+        
+        # Les colonnes lourdes (description, image) ne sont chargées que pour la page retournée
+        products = airtable_service.select_fields(store.records_for(ordinals), ProductFields.LISTING)
         
         logger.info(f"✅ Retrieved {len(products)} products")
         
@@ -154,8 +257,6 @@ async def get_products(
         logger.error(f"❌ Error fetching products: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-        @rate_limit(max_requests=30, window_seconds=60)
-@cache_response(ttl_seconds=900)  # 15 minutes
 @app.post("/api/recommendations", tags=["Recommendations"])
 async def get_recommendations(
     budget: float = 50.0,
@@ -176,14 +277,25 @@ async def get_recommendations(
     try:
         logger.info(f"🎁 Generating recommendations: budget={budget}$, age={recipient_age}, occasion={occasion}")
         
-        # Récupérer tous les produits
-        all_products = await airtable_service.get_all_products()
+        # Récupérer le catalogue (prix déjà analysés en float)
+        store = await get_search_store()
         
         # Filtrer par budget
-        products_in_budget = [
-            p for p in all_products 
-            if float(p.get('Price', '0').replace('$', '').strip() or 0) <= budget
-        ]
+        ordinals = store.price_between(max_value=budget)
+        
+        # Classer par pertinence BM25 selon les intérêts, pour n'envoyer au LLM que les meilleurs candidats
+        ranked = None
+        if interests and ordinals:
+            ranked = get_search_engine().keyword_search(
+                f"{interests} {occasion}", store, ["name", "category", "description"], set(ordinals)
+            )
+        if ranked:
+            candidates = [ordinal for ordinal, _ in ranked[:RECOMMENDATION_CANDIDATES]]
+        else:
+            # Sans classement: ordre du catalogue (price_between trie par prix, on enverrait les moins chers)
+            candidates = heapq.nsmallest(RECOMMENDATION_CANDIDATES, ordinals)
+        
+        products_in_budget = store.records_for(candidates)
         
         if not products_in_budget:
             logger.warning(f"⚠️  No products found within budget {budget}$")
@@ -193,6 +305,10 @@ async def get_recommendations(
                 "recommendations": []
             }
         
+        products_in_budget = airtable_service.select_fields(
+            products_in_budget, ProductFields.RECOMMENDATION
+        )
+        
         # Préparer le contexte utilisateur
         user_input = f"""
         Budget: ${budget} CAD
@@ -200,75 +316,89 @@ async def get_recommendations(
         Occasion: {occasion}
         Intérêts: {interests}
         Nombre de recommandations: {count}
+        """
+        
+        # Générer les recommandations avec LangChain
+        recommendations = await recommendation_engine.generate_recommendations(
+            user_input=user_input,
+            products=products_in_budget,
+            count=count
+        )
+        
+        logger.info(f"✅ Generated {len(recommendations)} recommendations")
+        
+        return {
+            "status": "success",
+            "count": len(recommendations),
+            "recommendations": recommendations
+        }
+    except Exception as e:
+        logger.error(f"❌ Error generating recommendations: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        # Search endpoint avec optimisations
-        @rate_limit(max_requests=60, window_seconds=60)
-@cache_response(ttl_seconds=600)  # 10 minutes
-@app.get("/api/search", response_model=ProductsResponse)
+# Search endpoint avec optimisations
+@app.get("/api/search", response_model=SearchResponse)
 async def search_products(
+    request: Request,
+    response: Response,
     query: str,
     skip: int = 0,
     limit: int = 20,
     price_min: Optional[float] = None,
-    price_max: Optional[float] = None
+    price_max: Optional[float] = None,
+    categories: Optional[List[str]] = Query(None),
+    tags: Optional[List[str]] = Query(None),
+    facets: bool = False
 ):
     """Search products with advanced filtering."""
     try:
         # Validate pagination
         skip, limit = validate_pagination(skip, limit)
         
-        # Fetch all products from Airtable
-        products = await airtable_service.fetch_products()
+        # Fetch all products from the local catalog
+        store = await get_search_store()
+        not_modified = check_not_modified(store, request, response)
+        if not_modified is not None:
+            return not_modified
         
         # Apply search and filters
-        from app.services.search_engine import get_search_engine
         search_engine = get_search_engine()
         
+        search_fields = list(SEARCH_FIELDS)
         filters = {
             'price_min': price_min,
             'price_max': price_max,
-            'search_fields': ['name', 'description', 'category']
+            'categories': categories,
+            'tags': tags,
+            'search_fields': search_fields
         }
         
-        filtered = search_engine.combined_search(query, products, filters)
+        # Correct typos against the catalog vocabulary before retrieval
+        corrected_query, corrections = search_engine.correct_query(query, store, search_fields)
         
-        # Paginate results
-        total = len(filtered)
-        items = filtered[skip:skip + limit]
+        # Only the requested page is ranked and materialized
+        page, total = search_engine.combined_search(corrected_query, store, filters, skip=skip, limit=limit)
+        items = airtable_service.select_fields(page, ProductFields.SEARCH)
+        
+        # Facet counts for the UI, from the same bitmaps as the filters
+        facet_counts = search_engine.facet_counts(corrected_query, store, filters) if facets else None
         
-        return ProductsResponse(
+        return SearchResponse(
             status="success",
             total=total,
             skip=skip,
             limit=limit,
-            items=items
+            items=items,
+            did_you_mean=corrected_query if corrections else None,
+            corrections=corrections,
+            facets=facet_counts
         )
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-        """
-        
-        # Générer les recommandations avec LangChain
-        recommendations = await recommendation_engine.generate_recommendations(
-            user_input=user_input,
-            products=products_in_budget,
-            count=count
-        )
-        
-        logger.info(f"✅ Generated {len(recommendations)} recommendations")
-        
-        return {
-            "status": "success",
-            "count": len(recommendations),
-            "recommendations": recommendations
-        }
-    except Exception as e:
-        logger.error(f"❌ Error generating recommendations: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
 
 
-@rate_limit(max_requests=60, window_seconds=60)
-@cache_response(ttl_seconds=600)  # 10 minutes
 @app.get("/api/search/suggestions", response_model=Dict[str, Any])
 async def get_search_suggestions(
     query: str,
@@ -276,13 +406,12 @@ async def get_search_suggestions(
 ) -> Dict[str, Any]:
     """Get search suggestions for auto-complete."""
     try:
-        # Fetch all products from Airtable
-        products = await airtable_service.fetch_products()
+        # Fetch all products from the local catalog
+        store = await get_search_store()
         
         # Apply search suggestions
-        from app.services.search_engine import get_search_engine
         search_engine = get_search_engine()
-        suggestions = search_engine.suggest(query, products, limit=limit)
+        suggestions = search_engine.suggest(query, store, limit=limit)
         
         return {
             "status": "success",
@@ -295,10 +424,10 @@ async def get_search_suggestions(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@rate_limit(max_requests=60, window_seconds=60)
-@cache_response(ttl_seconds=1800)  # 30 minutes
-    @app.get("/api/products/categories", response_model=Dict[str, Any])
+@app.get("/api/products/categories", response_model=Dict[str, Any])
 async def get_product_categories(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 50
 ) -> Dict[str, Any]:
@@ -308,36 +437,33 @@ async def get_product_categories(
         from app.core.validators import validate_pagination
         skip, limit = validate_pagination(skip, limit)
         
-        # Fetch all products from Airtable
-        products = await airtable_service.fetch_products()
-        
-        # Extract unique categories
-        categories = set()
-        for product in products:
-            if 'category' in product:
-                categories.add(product['category'])
+        # Fetch all products from the local catalog
+        store = await airtable_service.get_product_store()
+        not_modified = check_not_modified(store, request, response)
+        if not_modified is not None:
+            return not_modified
         
-        categories_list = sorted(list(categories))
+        # Sorted category listing with counts, built once per catalog version
+        category_counts = store.category_counts
         
         # Paginate results
-        total = len(categories_list)
-        items = categories_list[skip:skip + limit]
+        total = len(category_counts)
+        page = category_counts[skip:skip + limit]
         
         return {
             "status": "success",
             "total": total,
             "skip": skip,
             "limit": limit,
-            "categories": items
+            "categories": [name for name, _ in page],
+            "counts": dict(page)
         }
     
     except Exception as e:
         logger.error(f"Categories error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@rate_limit(max_requests=30, window_seconds=60)
-@cache_response(ttl_seconds=900)  # 15 minutes
-        @app.get("/api/recommendations/quick", response_model=Dict[str, Any])
+@app.get("/api/recommendations/quick", response_model=Dict[str, Any])
 async def get_quick_recommendations(
     query: str = "cadeau",
     count: int = 5
@@ -348,14 +474,14 @@ async def get_quick_recommendations(
         if count < 1 or count > 20:
             count = 5
         
-        # Fetch products from Airtable with budget constraint
-        products = await airtable_service.fetch_products()
+        # Fetch products from the local catalog
+        store = await airtable_service.get_product_store()
         
-        # Filter products within reasonable budget (default: 0-200)
-        products_in_budget = [
-            p for p in products
-            if p.get('price', 0) <= 200
-        ]
+        # Filter products within reasonable budget (default: 0-200), in catalog order
+        products_in_budget = store.records_for(sorted(store.price_between(0, 200)))
+        products_in_budget = airtable_service.select_fields(
+            products_in_budget, ProductFields.RECOMMENDATION
+        )
         
         # Create simple user input
         user_input = {
@@ -383,6 +509,42 @@ async def get_quick_recommendations(
     except Exception as e:
         logger.error(f"❌ Quick recommendations error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+# ============ ENDPOINTS INTERNES ============
+
+@app.post("/api/internal/catalog-changed", tags=["Internal"])
+async def catalog_changed(
+    notification: CatalogChangeNotification,
+    request: Request
+) -> Dict[str, Any]:
+    """Appliquer tout de suite les modifications signalées par n8n
+
+    Seuls les enregistrements indiqués sont relus dans Airtable; le catalogue,
+    ses index et les ETags changent de version dans la foulée.
+    """
+    secret = settings.CATALOG_WEBHOOK_SECRET
+    provided = request.headers.get("x-webhook-secret", "")
+    if not secret or not hmac.compare_digest(provided.encode(), secret.encode()):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    
+    try:
+        result = await airtable_service.apply_changes(notification.record_ids, notification.deleted_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Catalog change notification error: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
+    
+    # Mettre à jour le catalogue et les index de recherche maintenant plutôt qu'à la prochaine requête
+    store = await get_search_store()
+    
+    return {
+        "status": "success",
+        **result,
+        "version": store.version,
+        "content_hash": store.content_hash
+    }
+
 # ============ DEMARRAGE ============
 
 if __name__ == "__main__":
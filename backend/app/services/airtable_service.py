@@ -1,72 +1,573 @@
 """Airtable integration service for product data"""
 
-import os
+import re
+import time
+import random
+import asyncio
 import httpx
 import logging
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, AsyncIterator, Set, Sequence
+
+from app.core.cache import SingleFlight
+from app.core.rate_limiter import OutboundRequestScheduler, RequestPriority
+from app.services.catalog_store import CatalogStore, CatalogGeneration, ProductFields
+from app.services.product_store import ProductStore
 
 logger = logging.getLogger(__name__)
 
+# Airtable returns at most 100 records per page
+AIRTABLE_PAGE_SIZE = 100
+
+# HTTP statuses worth retrying for idempotent reads
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Single-flight key of the catalog refresh
+CATALOG_KEY = "catalog"
+
+# Single-flight key prefix of the product store build of a catalog version
+PRODUCT_STORE_KEY = "product_store"
+
+# Margin subtracted from the sync watermark to absorb clock skew with Airtable
+SYNC_SKEW = timedelta(seconds=5)
+
+# Airtable record ids; anything else is refused before it reaches a formula
+RECORD_ID_PATTERN = re.compile(r"^rec[A-Za-z0-9]{14}$")
+
+# Record ids per RECORD_ID() formula, to keep request URLs short
+RECORD_ID_CHUNK_SIZE = 50
+
+# Catalog deltas touching at most this share of the products (or this many)
+# are applied to the current product store instead of rebuilding it
+INCREMENTAL_MAX_SHARE = 0.1
+INCREMENTAL_MIN_CHANGES = 100
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 
 class AirtableService:
     """Service for interacting with Airtable API"""
-    
-    def __init__(self, api_key: str, base_id: str, table_id: str):
+
+    def __init__(
+        self,
+        api_key: str,
+        base_id: str,
+        table_id: str,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+        timeout: Optional[httpx.Timeout] = None,
+        catalog: Optional[CatalogStore] = None,
+        sync_interval: float = 300.0,
+        reconcile_interval: float = 3600.0,
+        refresh_retry_interval: float = 30.0,
+        id_probe_field: str = "Name",
+        catalog_fields: Optional[Sequence[str]] = ProductFields.CATALOG,
+        rate_limit: float = 5.0,
+        burst: int = 5,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        base_url: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
         self.api_key = api_key
         self.base_id = base_id
         self.table_id = table_id
-        self.base_url = f"https://api.airtable.com/v0/{base_id}/{table_id}"
+        # base_url/transport can point the service at a local emulator (tests/airtable_emulator.py)
+        self.base_url = base_url or f"https://api.airtable.com/v0/{base_id}/{table_id}"
+        self.transport = transport
         self.headers = {"Authorization": f"Bearer {api_key}"}
-    
-    async def get_all_products(self) -> List[Dict[str, Any]]:
-        """Fetch all products from Airtable"""
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+        self.timeout = timeout or httpx.Timeout(connect=5.0, read=15.0, write=10.0, pool=5.0)
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._handshakes = 0
+        self._requests = 0
+
+        self.catalog = catalog if catalog is not None else CatalogStore()
+        self.sync_interval = timedelta(seconds=sync_interval)
+        self.reconcile_interval = timedelta(seconds=reconcile_interval)
+        self.refresh_retry_interval = refresh_retry_interval
+        self.id_probe_field = id_probe_field
+        self.catalog_fields = list(catalog_fields) if catalog_fields else None
+
+        self._flights = SingleFlight()
+        self._product_store: Optional[ProductStore] = None
+
+        # Airtable allows ~5 requests/second per base
+        self.scheduler = OutboundRequestScheduler(rate=rate_limit, burst=burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._retries = 0
+        self._throttled = 0
+        self._refresher: Optional[asyncio.Task] = None
+        self.last_refresh_error: Optional[str] = None
+        self.refresh_failures = 0
+        self._last_refresh_failure: Optional[float] = None
+
+    async def start(self):
+        """Open the shared HTTP client (called from the startup event)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport
+            )
+            logger.info(f"Airtable HTTP client started (http2={self.http2})")
+
+    async def close(self):
+        """Close the shared HTTP client and its pooled connections"""
+        await self.scheduler.close()
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Airtable HTTP client closed")
+        self._client = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared client, opening it lazily if needed"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        return self._client
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore trace hook used to count new TCP connections"""
+        if event_name == "connection.connect_tcp.complete":
+            self._handshakes += 1
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Connection pool statistics, to confirm keep-alive reuse under load"""
+        connections = []
+        if self._client is not None and not self._client.is_closed:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": self.http2,
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "handshakes": self._handshakes,
+            "requests": self._requests,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """Outbound queue depth, wait times, retries and 429s"""
+        return {
+            **self.scheduler.get_stats(),
+            "retries": self._retries,
+            "throttled": self._throttled,
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        """Parse a Retry-After header given in seconds"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.base_url, headers=self.headers)
-                response.raise_for_status()
-                data = response.json()
-                
-                products = []
-                for record in data.get("records", []):
-                    product = {
-                        "id": record.get("id"),
-                        **record.get("fields", {})
-                    }
-                    products.append(product)
-                
-                logger.info(f"Retrieved {len(products)} products from Airtable")
-                return products
-        except Exception as e:
-            logger.error(f"Error fetching products from Airtable: {str(e)}")
-            return []
-    
-    async def search_products(
+            return max(0.0, float(response.headers["Retry-After"]))
+        except (KeyError, ValueError):
+            return None
+
+    async def _get(
         self,
-        query: str,
-        fields: Optional[List[str]] = None
-    ) -> List[Dict[str, Any]]:
-        """Search products with formula"""
-        try:
-            if not fields:
-                fields = ["Name", "ASIN", "Price", "Category", "Description, "Image""]
-            
-            formula = f'SEARCH("{query.lower()}", LOWER({{Name}}))'
-            params = {"filterByFormula": formula}
-            
-            async with httpx.AsyncClient() as client:
+        client: httpx.AsyncClient,
+        params: Dict[str, Any],
+        priority: int
+    ) -> httpx.Response:
+        """
+        Throttled, retried GET against the table.
+
+        Every attempt waits for a scheduler token. Reads are idempotent, so
+        429s, 5xx and transport errors are retried with jittered backoff; a
+        429 also pauses the whole queue for its Retry-After.
+        """
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(priority)
+            self._requests += 1
+            try:
                 response = await client.get(
                     self.base_url,
-                    headers=self.headers,
-                    params=params
+                    params=params,
+                    extensions={"trace": self._trace}
+                )
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"Airtable transport error ({str(e)}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                if response.status_code == 429:
+                    self._throttled += 1
+                    self.scheduler.pause(delay)
+                logger.warning(f"Airtable returned {response.status_code}, retrying in {delay:.2f}s")
+
+            attempt += 1
+            self._retries += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _record_to_product(record: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten an Airtable record into a product dict"""
+        return {
+            "id": record.get("id"),
+            **record.get("fields", {})
+        }
+
+    async def _fetch_page(
+        self,
+        client: httpx.AsyncClient,
+        params: Dict[str, Any],
+        offset: Optional[str] = None,
+        priority: int = RequestPriority.INTERACTIVE
+    ) -> Dict[str, Any]:
+        """Fetch a single page of records, starting at the given cursor"""
+        page_params = {**params, "pageSize": AIRTABLE_PAGE_SIZE}
+        if offset:
+            page_params["offset"] = offset
+
+        response = await self._get(client, page_params, priority)
+        return response.json()
+
+    async def iter_products(
+        self,
+        params: Optional[Dict[str, Any]] = None,
+        priority: int = RequestPriority.INTERACTIVE,
+        fields: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream products from Airtable, following the `offset` cursor.
+
+        The request for page n+1 is issued before page n is yielded, so
+        parsing and consuming a page overlaps with the next round trip.
+        `fields` limits the columns Airtable sends back (`fields[]`).
+        Errors are propagated to the caller.
+        """
+        params = dict(params or {})
+        if fields:
+            params["fields[]"] = list(fields)
+        client = await self._get_client()
+
+        pending = asyncio.create_task(self._fetch_page(client, params, priority=priority))
+        try:
+            while pending is not None:
+                data = await pending
+                offset = data.get("offset")
+                pending = (
+                    asyncio.create_task(self._fetch_page(client, params, offset, priority))
+                    if offset else None
                 )
-                response.raise_for_status()
-                data = response.json()
-                
-                products = [
-                    {"id": r.get("id"), **r.get("fields", {})}
-                    for r in data.get("records", [])
-                ]
-                return products
+
+                for record in data.get("records", []):
+                    yield self._record_to_product(record)
+        finally:
+            # Consumer stopped early or a page failed: drop the prefetch
+            if pending is not None and not pending.done():
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    def load_catalog(self) -> int:
+        """Load the local catalog snapshot, without contacting Airtable"""
+        return self.catalog.load()
+
+    async def _list_record_ids(self) -> Set[str]:
+        """List every record id, projecting a single small field"""
+        return {
+            product["id"]
+            async for product in self.iter_products(
+                priority=RequestPriority.BACKGROUND,
+                fields=[self.id_probe_field]
+            )
+        }
+
+    async def sync_catalog(self, full: bool = False) -> Dict[str, int]:
+        """
+        Bring the local catalog up to date with Airtable.
+
+        Only records modified since the last sync are fetched, through a
+        LAST_MODIFIED_TIME() filter. Deletions cannot be seen in a delta, so
+        the id list is reconciled every `reconcile_interval` (and on every
+        full load). Only `catalog_fields` are downloaded; when that set
+        changes, a full sync backfills the new columns.
+        """
+        started = datetime.now(timezone.utc)
+        signature = ",".join(sorted(self.catalog_fields or []))
+        if self.catalog.fields_signature not in (None, signature):
+            full = True
+        since = None if full else self.catalog.last_sync
+
+        params = {}
+        if since is not None:
+            watermark = (since - SYNC_SKEW).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            params["filterByFormula"] = f"IS_AFTER(LAST_MODIFIED_TIME(), '{watermark}')"
+
+        changed = [
+            product
+            async for product in self.iter_products(
+                params, RequestPriority.BACKGROUND, self.catalog_fields
+            )
+        ]
+
+        reconciled = since is None or (
+            self.catalog.last_reconcile is None
+            or started - self.catalog.last_reconcile >= self.reconcile_interval
+        )
+        deleted: Set[str] = set()
+        if reconciled:
+            if since is None:
+                live_ids = {product["id"] for product in changed}
+            else:
+                live_ids = await self._list_record_ids()
+            deleted = set(self.catalog.ids()) - live_ids
+
+        await asyncio.to_thread(
+            self.catalog.apply_delta, changed, deleted, started, reconciled, signature
+        )
+
+        logger.info(
+            f"Catalog sync ({'full' if since is None else 'delta'}): "
+            f"{len(changed)} changed, {len(deleted)} deleted, {len(self.catalog)} total"
+        )
+        return {"changed": len(changed), "deleted": len(deleted), "total": len(self.catalog)}
+
+    async def apply_changes(
+        self,
+        record_ids: Sequence[str],
+        deleted_ids: Sequence[str] = ()
+    ) -> Dict[str, int]:
+        """
+        Apply a targeted delta for records reported as changed (n8n webhook).
+
+        Only the given records are fetched, through RECORD_ID() formulas;
+        ids Airtable no longer returns are treated as deleted. The sync
+        watermark is left untouched, so the periodic delta sync still
+        covers anything the notification missed.
+        """
+        invalid = [
+            record_id for record_id in [*record_ids, *deleted_ids]
+            if not RECORD_ID_PATTERN.match(record_id)
+        ]
+        if invalid:
+            raise ValueError(f"Invalid Airtable record ids: {', '.join(invalid[:5])}")
+
+        wanted = list(dict.fromkeys(record_ids))
+        changed: List[Dict[str, Any]] = []
+        for start in range(0, len(wanted), RECORD_ID_CHUNK_SIZE):
+            chunk = wanted[start:start + RECORD_ID_CHUNK_SIZE]
+            formula = "OR(" + ",".join(f"RECORD_ID()='{record_id}'" for record_id in chunk) + ")"
+            changed.extend([
+                product
+                async for product in self.iter_products(
+                    {"filterByFormula": formula}, RequestPriority.INTERACTIVE, self.catalog_fields
+                )
+            ])
+
+        returned = {product["id"] for product in changed}
+        deleted = {record_id for record_id in wanted if record_id not in returned}
+        deleted.update(deleted_ids)
+
+        await asyncio.to_thread(self.catalog.apply_delta, changed, deleted)
+
+        logger.info(f"Catalog change notification: {len(changed)} changed, {len(deleted)} deleted")
+        return {"changed": len(changed), "deleted": len(deleted), "total": len(self.catalog)}
+
+    def catalog_is_stale(self) -> bool:
+        """True when the local catalog is older than `sync_interval`"""
+        last_sync = self.catalog.last_sync
+        return last_sync is None or datetime.now(timezone.utc) - last_sync >= self.sync_interval
+
+    async def refresh_catalog(self, full: bool = False) -> bool:
+        """
+        Run one sync; on failure the last known good catalog is kept.
+
+        Concurrent callers share the refresh already in flight (whose
+        `full` flag wins) instead of starting another pass over Airtable.
+        """
+        return await self._flights.do(CATALOG_KEY, self._refresh_catalog, full)
+
+    async def _refresh_catalog(self, full: bool = False) -> bool:
+        try:
+            await self.sync_catalog(full)
+            self.last_refresh_error = None
+            self.refresh_failures = 0
+            self._last_refresh_failure = None
+            return True
         except Exception as e:
-            logger.error(f"Error searching products: {str(e)}")
-            return []
+            self.refresh_failures += 1
+            self.last_refresh_error = str(e)
+            self._last_refresh_failure = time.monotonic()
+            logger.error(
+                f"Catalog refresh failed ({self.refresh_failures} in a row), "
+                f"serving last known good version: {str(e)}"
+            )
+            return False
+
+    def refresh_backing_off(self) -> bool:
+        """True while the last refresh failed less than `refresh_retry_interval` ago"""
+        failed_at = self._last_refresh_failure
+        return failed_at is not None and time.monotonic() - failed_at < self.refresh_retry_interval
+
+    def _ensure_refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already running, return its task"""
+        return self._flights.submit(CATALOG_KEY, self._refresh_catalog)
+
+    async def _refresh_loop(self):
+        """Refresh the catalog on a schedule, retrying sooner after a failure"""
+        while True:
+            ok = await asyncio.shield(self._ensure_refresh())
+            delay = self.sync_interval.total_seconds() if ok else self.refresh_retry_interval
+            await asyncio.sleep(delay)
+
+    def start_refresher(self):
+        """Start the background catalog refresher (called from the startup event)"""
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh_loop())
+            logger.info(f"Catalog refresher started (every {self.sync_interval.total_seconds():.0f}s)")
+
+    async def stop_refresher(self):
+        """Stop the background refresher and any refresh in flight"""
+        for task in (self._refresher, self._flights.get(CATALOG_KEY)):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._refresher = None
+
+    def get_catalog_status(self) -> Dict[str, Any]:
+        """Catalog freshness, reported by /api/health"""
+        last_sync = self.catalog.last_sync
+        age = (datetime.now(timezone.utc) - last_sync).total_seconds() if last_sync else None
+        return {
+            "products": len(self.catalog),
+            "version": self.catalog.version,
+            "content_hash": self.catalog.content_hash,
+            "last_sync": last_sync.isoformat() if last_sync else None,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "stale": self.catalog_is_stale(),
+            "refreshing": self._flights.get(CATALOG_KEY) is not None,
+            "last_error": self.last_refresh_error,
+            "consecutive_failures": self.refresh_failures,
+        }
+
+    async def get_all_products(
+        self,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return all products from the local catalog.
+
+        `fields` projects every record to those columns (see ProductFields);
+        without it only the light, in-memory columns are returned.
+        A stale catalog is served as is while a refresh runs in the
+        background (not before `refresh_retry_interval` after a failed
+        one); only a cold start with no snapshot waits for Airtable.
+        """
+        if self.catalog.last_sync is None and not len(self.catalog):
+            await asyncio.shield(self._ensure_refresh())
+        elif self.catalog_is_stale() and not self.refresh_backing_off():
+            self._ensure_refresh()
+        return self.catalog.get_all(fields)
+
+    async def get_product_store(self) -> ProductStore:
+        """
+        Typed, columnar view of the catalog, one per catalog version.
+
+        A small delta (see INCREMENTAL_MAX_SHARE) is applied to the previous
+        store and its indexes (see ProductStore.apply_changes for its cost);
+        otherwise the store is rebuilt from the whole catalog. Either runs
+        off the event loop, once per version however many requests wait.
+        """
+        await self.get_all_products()
+        # Records, version and hash from one published generation: a sync may
+        # publish the next one while this store is being built
+        generation = self.catalog.generation
+        store = self._product_store
+        if store is not None and store.version == generation.version:
+            return store
+        return await self._flights.do(
+            f"{PRODUCT_STORE_KEY}:{generation.version}", self._build_product_store, generation
+        )
+
+    async def _build_product_store(self, generation: CatalogGeneration) -> ProductStore:
+        version = generation.version
+        store = self._product_store
+        changes = self.catalog.changes_since(store.version, version) if store is not None else None
+        if changes is not None and (
+            len(changes[0]) + len(changes[1])
+            <= max(INCREMENTAL_MIN_CHANGES, INCREMENTAL_MAX_SHARE * store.live_count)
+        ):
+            upserts = [
+                product for product in map(generation.products.get, changes[0])
+                if product is not None
+            ]
+            store = await asyncio.to_thread(
+                store.apply_changes, upserts, changes[1],
+                version=version, content_hash=generation.content_hash
+            )
+        else:
+            store = await asyncio.to_thread(
+                ProductStore,
+                generation.snapshot,
+                version=version,
+                column_loader=lambda products, field: [
+                    product.get(field) for product in self.catalog.materialize(products, (field,))
+                ],
+                content_hash=generation.content_hash
+            )
+            logger.info(f"Built product store v{version} ({len(store)} products)")
+
+        # Builds of two versions may finish out of order: keep the newest
+        if self._product_store is None or self._product_store.version < version:
+            self._product_store = store
+        return store
+
+    def replace_product_store(self, current: ProductStore, replacement: ProductStore):
+        """Adopt a compacted copy of the current store, unless the catalog has moved on since"""
+        if self._product_store is current and replacement.version == current.version:
+            self._product_store = replacement
+
+    def select_fields(
+        self,
+        products: List[Dict[str, Any]],
+        fields: Sequence[str]
+    ) -> List[Dict[str, Any]]:
+        """Project already-filtered products, loading heavy columns for them only"""
+        return self.catalog.materialize(products, fields)
+
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """How many concurrent Airtable calls were coalesced into one"""
+        return self._flights.get_stats()
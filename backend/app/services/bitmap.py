@@ -0,0 +1,78 @@
+"""Sets of product ordinals as bitmaps
+
+A bitmap is a plain Python int where bit i is set when ordinal i is in the
+set. Intersection and union are single `&` / `|` operations running in C
+over the whole catalog (a 20k-product catalog fits in 2.5 KB), and
+`int.bit_count()` gives the cardinality without decoding the set.
+"""
+
+from typing import Iterable, List, Optional, Sequence
+
+EMPTY = 0
+
+# Set bit positions of every byte value, to decode a bitmap byte by byte
+_BYTE_BITS = tuple(
+    tuple(bit for bit in range(8) if value >> bit & 1)
+    for value in range(256)
+)
+
+
+def from_ordinals(ordinals: Iterable[int], size: Optional[int] = None) -> int:
+    """Bitmap of `ordinals` (`size` is a hint of the largest ordinal + 1)"""
+    buffer = bytearray(((size or 0) + 7) >> 3)
+    for ordinal in ordinals:
+        index = ordinal >> 3
+        if index >= len(buffer):
+            buffer.extend(bytes(index + 1 - len(buffer)))
+        buffer[index] |= 1 << (ordinal & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def full(size: int) -> int:
+    """Bitmap of every ordinal below `size`"""
+    return (1 << size) - 1
+
+
+def to_ordinals(bitmap: int) -> List[int]:
+    """Ordinals of `bitmap`, ascending"""
+    ordinals: List[int] = []
+    if not bitmap:
+        return ordinals
+    extend = ordinals.extend
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) >> 3, "little")
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            extend([base + bit for bit in _BYTE_BITS[byte]])
+    return ordinals
+
+
+def count(bitmap: int) -> int:
+    """Number of ordinals in `bitmap`"""
+    return bitmap.bit_count()
+
+
+def union(bitmaps: Iterable[int]) -> int:
+    """Ordinals in any of `bitmaps`"""
+    result = EMPTY
+    for bitmap in bitmaps:
+        result |= bitmap
+    return result
+
+
+def intersect(bitmaps: Sequence[int]) -> int:
+    """
+    Ordinals in every one of `bitmaps`.
+
+    The most selective bitmap goes first and the intersection stops as
+    soon as it is empty.
+    """
+    if not bitmaps:
+        raise ValueError("intersect() needs at least one bitmap")
+    ordered = sorted(bitmaps, key=count)
+    result = ordered[0]
+    for bitmap in ordered[1:]:
+        if not result:
+            break
+        result &= bitmap
+    return result
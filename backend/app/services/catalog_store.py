@@ -0,0 +1,367 @@
+"""Local persistent mirror of the Airtable product catalog"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Max bound parameters per SQLite statement when loading heavy columns
+SQLITE_CHUNK_SIZE = 500
+
+# Record digests are summed modulo this to give the catalog content hash
+DIGEST_MODULUS = 1 << 128
+
+# Catalog versions whose changed ids are kept for incremental consumers
+CHANGE_LOG_SIZE = 64
+
+
+class ProductFields:
+    """Airtable columns read by each endpoint"""
+
+    # Every column the application uses; anything else in the table is never downloaded
+    CATALOG = ("Name", "ASIN", "Price", "Category", "Tags", "Description", "Image")
+
+    # Long text and attachments, kept out of memory until a response needs them
+    HEAVY = ("Description", "Image")
+
+    LISTING = ("Name", "ASIN", "Price", "Category", "Image")
+    RECOMMENDATION = ("Name", "Price", "Category", "Description")
+    SEARCH = ("Name", "Price", "Category", "Description")
+
+
+class CatalogGeneration:
+    """One published catalog version, swapped in as a whole so readers never mix two"""
+
+    __slots__ = ("version", "products", "snapshot", "content_hash")
+
+    def __init__(
+        self,
+        version: int,
+        products: Dict[str, Dict[str, Any]],
+        snapshot: List[Dict[str, Any]],
+        content_hash: str
+    ):
+        self.version = version
+        self.products = products
+        self.snapshot = snapshot
+        self.content_hash = content_hash
+
+
+class CatalogStore:
+    """
+    SQLite-backed catalog snapshot with an in-memory read view.
+
+    Reads never touch SQLite for light columns: they are kept in memory and
+    the database is only written when a sync applies a delta, so a restart
+    can serve requests from the last snapshot without waiting on Airtable.
+    Heavy columns stay on disk and are loaded only for the records (or the
+    projections) that actually include them.
+
+    Each record has a digest of its content; their sum is the catalog
+    `content_hash`, updated incrementally by every delta and used as the
+    base of HTTP ETags. Consumers that need several of these together read
+    `generation` once instead of the individual attributes, which a sync
+    thread may republish in between. The ids changed by the last CHANGE_LOG_SIZE deltas
+    are kept (see changes_since) so derived views can be updated in place
+    of rebuilt.
+    """
+
+    def __init__(self, path: str = ":memory:", heavy_fields: Sequence[str] = ProductFields.HEAVY):
+        self.path = path
+        self.heavy_fields = frozenset(heavy_fields)
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            "id TEXT PRIMARY KEY, fields TEXT NOT NULL, heavy TEXT NOT NULL DEFAULT '{}', "
+            "digest TEXT NOT NULL DEFAULT '')"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(products)")}
+        if "heavy" not in columns:
+            # Snapshot predates the light/heavy split: add the column and force a full sync
+            self._conn.execute("ALTER TABLE products ADD COLUMN heavy TEXT NOT NULL DEFAULT '{}'")
+            self._conn.execute("DELETE FROM meta WHERE key = 'last_sync'")
+        if "digest" not in columns:
+            # Snapshot predates content hashing: rows get their digest on the next full sync
+            self._conn.execute("ALTER TABLE products ADD COLUMN digest TEXT NOT NULL DEFAULT ''")
+            self._conn.execute("DELETE FROM meta WHERE key = 'last_sync'")
+        self._conn.commit()
+
+        self._projections: Dict[Tuple[str, ...], Tuple[int, List[Dict[str, Any]]]] = {}
+        self._changes: Dict[int, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+        self._digests: Dict[str, int] = {}
+        self._digest_sum = 0
+        self.generation = CatalogGeneration(0, {}, [], self._format_hash(0))
+        self.last_sync: Optional[datetime] = None
+        self.last_reconcile: Optional[datetime] = None
+        self.fields_signature: Optional[str] = None
+
+    @property
+    def version(self) -> int:
+        """Version of the published catalog, bumped by every non-empty delta"""
+        return self.generation.version
+
+    @property
+    def content_hash(self) -> str:
+        """Content hash of the published catalog"""
+        return self.generation.content_hash
+
+    def load(self) -> int:
+        """Load the persisted snapshot into memory, returns the product count"""
+        rows = self._conn.execute("SELECT id, fields, digest FROM products").fetchall()
+        self._digests = {row[0]: int(row[2], 16) if row[2] else 0 for row in rows}
+        self._digest_sum = sum(self._digests.values()) % DIGEST_MODULUS
+        self._changes = {}
+        self._publish({row[0]: {"id": row[0], **json.loads(row[1])} for row in rows})
+
+        self.last_sync = self._get_meta_datetime("last_sync")
+        self.last_reconcile = self._get_meta_datetime("last_reconcile")
+        self.fields_signature = self._get_meta("fields_signature")
+
+        logger.info(f"Loaded {len(self)} products from local catalog {self.path}")
+        return len(self)
+
+    def _split(self, product: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Split a product into its light (in memory) and heavy (on disk) columns"""
+        light, heavy = {}, {}
+        for key, value in product.items():
+            if key in self.heavy_fields:
+                heavy[key] = value
+            else:
+                light[key] = value
+        return light, heavy
+
+    @staticmethod
+    def _digest(product: Dict[str, Any]) -> int:
+        """128-bit digest of one record's content (light and heavy columns)"""
+        payload = json.dumps(product, sort_keys=True, separators=(",", ":"), default=str)
+        return int.from_bytes(hashlib.blake2b(payload.encode(), digest_size=16).digest(), "big")
+
+    @staticmethod
+    def _format_hash(value: int) -> str:
+        return f"{value:032x}"
+
+    def apply_delta(
+        self,
+        upserts: List[Dict[str, Any]],
+        deleted_ids: Iterable[str] = (),
+        synced_at: Optional[datetime] = None,
+        reconciled: bool = False,
+        fields_signature: Optional[str] = None
+    ):
+        """
+        Persist changed and deleted records, then update the memory view.
+
+        Writers (periodic sync, change notifications) are serialized on the
+        store lock; readers only ever see whole published generations. The
+        memory view is copy-on-write: publishing copies the id -> product
+        dict and the snapshot list (pointer copies, about 2 ms for 20k
+        products) whatever the size of the delta.
+        """
+        split = [self._split(product) for product in upserts]
+        digests = [self._digest(product) for product in upserts]
+
+        with self._lock:
+            deleted_ids = [record_id for record_id in deleted_ids if record_id in self.generation.products]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO products (id, fields, heavy, digest) VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            light["id"],
+                            json.dumps({k: v for k, v in light.items() if k != "id"}),
+                            json.dumps(heavy),
+                            self._format_hash(digest)
+                        )
+                        for (light, heavy), digest in zip(split, digests)
+                    ]
+                )
+                self._conn.executemany(
+                    "DELETE FROM products WHERE id = ?",
+                    [(record_id,) for record_id in deleted_ids]
+                )
+                if synced_at:
+                    self._set_meta("last_sync", synced_at.isoformat())
+                    if reconciled:
+                        self._set_meta("last_reconcile", synced_at.isoformat())
+                if fields_signature is not None:
+                    self._set_meta("fields_signature", fields_signature)
+
+            # Content hash: swap the digests of changed records in and out of the sum
+            digest_sum = self._digest_sum
+            for (light, _), digest in zip(split, digests):
+                digest_sum += digest - self._digests.get(light["id"], 0)
+                self._digests[light["id"]] = digest
+            for record_id in deleted_ids:
+                digest_sum -= self._digests.pop(record_id, 0)
+            self._digest_sum = digest_sum % DIGEST_MODULUS
+
+            # Copy-on-write so readers on the event loop never see a dict being
+            # mutated by the sync thread
+            products = dict(self.generation.products)
+            for light, _ in split:
+                products[light["id"]] = light
+            for record_id in deleted_ids:
+                del products[record_id]
+            if upserts or deleted_ids:
+                # Change log entry of the version about to be published
+                changes = {
+                    version: entry for version, entry in self._changes.items()
+                    if version > self.version + 1 - CHANGE_LOG_SIZE
+                }
+                changes[self.version + 1] = (
+                    tuple(light["id"] for light, _ in split), tuple(deleted_ids)
+                )
+                self._changes = changes
+                self._publish(products)
+
+            if synced_at:
+                self.last_sync = synced_at
+                if reconciled:
+                    self.last_reconcile = synced_at
+            if fields_signature is not None:
+                self.fields_signature = fields_signature
+
+    def get_all(self, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the current catalog (shared list, must not be mutated).
+
+        Without `fields` only the light columns are returned. With `fields`
+        the records are projected to those columns (plus `id`), loading heavy
+        ones from disk; each projection is built once per catalog version.
+        """
+        generation = self.generation
+        if fields is None:
+            return generation.snapshot
+
+        key = tuple(fields)
+        version, snapshot = generation.version, generation.snapshot
+        cached = self._projections.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        projected = self.materialize(snapshot, key)
+        self._projections = {
+            k: v for k, v in self._projections.items() if v[0] == version
+        }
+        self._projections[key] = (version, projected)
+        return projected
+
+    def materialize(
+        self,
+        products: List[Dict[str, Any]],
+        fields: Sequence[str]
+    ) -> List[Dict[str, Any]]:
+        """Project products to `fields`, loading heavy columns for these records only"""
+        light_fields = [field for field in fields if field not in self.heavy_fields]
+        heavy_fields = [field for field in fields if field in self.heavy_fields]
+
+        heavy_by_id: Dict[str, Dict[str, Any]] = {}
+        if heavy_fields and products:
+            heavy_by_id = self._load_heavy([product["id"] for product in products])
+
+        projected = []
+        for product in products:
+            record = {"id": product["id"]}
+            for field in light_fields:
+                if field in product:
+                    record[field] = product[field]
+            if heavy_fields:
+                heavy = heavy_by_id.get(product["id"], {})
+                for field in heavy_fields:
+                    if field in heavy:
+                        record[field] = heavy[field]
+            projected.append(record)
+        return projected
+
+    def _load_heavy(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if len(ids) >= len(self):
+                rows = self._conn.execute("SELECT id, heavy FROM products").fetchall()
+            else:
+                rows = []
+                for start in range(0, len(ids), SQLITE_CHUNK_SIZE):
+                    chunk = ids[start:start + SQLITE_CHUNK_SIZE]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows.extend(self._conn.execute(
+                        f"SELECT id, heavy FROM products WHERE id IN ({placeholders})",
+                        chunk
+                    ).fetchall())
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def changes_since(
+        self,
+        version: int,
+        until: Optional[int] = None
+    ) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Ids upserted and deleted after catalog `version`, up to `until` (the
+        current one by default), or None when the change log does not cover
+        them (snapshot reload, or more than CHANGE_LOG_SIZE versions ago).
+        """
+        current, changes = self.version if until is None else until, self._changes
+        upserted: Dict[str, None] = {}
+        deleted: Dict[str, None] = {}
+        for changed_version in range(version + 1, current + 1):
+            entry = changes.get(changed_version)
+            if entry is None:
+                return None
+            for record_id in entry[0]:
+                deleted.pop(record_id, None)
+                upserted[record_id] = None
+            for record_id in entry[1]:
+                upserted.pop(record_id, None)
+                deleted[record_id] = None
+        return list(upserted), list(deleted)
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        """Return a single product (light columns) by Airtable record id"""
+        return self.generation.products.get(record_id)
+
+    def ids(self) -> List[str]:
+        """Return all known record ids"""
+        return list(self.generation.products)
+
+    def __len__(self) -> int:
+        return len(self.generation.products)
+
+    def close(self):
+        """Close the underlying database"""
+        self._conn.close()
+
+    def _publish(self, products: Dict[str, Dict[str, Any]]):
+        """Swap in a new catalog generation"""
+        self.generation = CatalogGeneration(
+            self.version + 1,
+            products,
+            list(products.values()),
+            self._format_hash(self._digest_sum)
+        )
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _get_meta_datetime(self, key: str) -> Optional[datetime]:
+        value = self._get_meta(key)
+        return datetime.fromisoformat(value) if value else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value)
+        )
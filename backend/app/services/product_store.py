@@ -0,0 +1,731 @@
+"""Typed, columnar view of the product catalog"""
+
+import copy
+import math
+import time
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from sys import getsizeof, intern
+from typing import List, Dict, Any, Optional, Callable, Iterable, Mapping, Sequence, Set, Tuple
+
+from app.core.utils import normalize_text, sizeof_items
+from app.services import bitmap
+from app.services.search_index import (
+    InvertedIndex, TrigramIndex, SuggestionIndex, SpellingIndex, SUGGESTION_FIELDS
+)
+from app.services.text_analyzer import FrenchAnalyzer, DEFAULT_ANALYZER
+
+logger = logging.getLogger(__name__)
+
+# Category code for products without a category
+NO_CATEGORY = -1
+
+# Cumulative price bitmaps kept along the price index (see price_bitmap)
+PRICE_BITMAP_CHECKPOINTS = 64
+
+# Compaction of a store updated by deltas (see needs_compaction): share of
+# tombstones, and delay after which stale dictionaries are rebuilt anyway
+COMPACTION_TOMBSTONE_RATIO = 0.2
+COMPACTION_DELAY_SECONDS = 600.0
+
+# Canonical Airtable column for each spelling used across the code base
+FIELD_ALIASES = {
+    "id": "id",
+    "name": "Name",
+    "description": "Description",
+    "price": "Price",
+    "category": "Category",
+    "tags": "Tags",
+    "asin": "ASIN",
+    "image": "Image",
+}
+
+
+def canonical_field(field: str) -> str:
+    """Map 'name', 'Name', 'NAME'... to the Airtable column name"""
+    return FIELD_ALIASES.get(field.lower(), field)
+
+
+def parse_price(value: Any) -> float:
+    """Parse '$34.99', '34,99 $' or 34.99 into a float, NaN when missing or invalid"""
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = str(value).replace("$", "").replace("CAD", "").replace("\u00a0", "").replace(" ", "")
+    cleaned = cleaned.replace(",", ".")
+    try:
+        return float(cleaned) if cleaned else math.nan
+    except ValueError:
+        return math.nan
+
+
+def parse_tags(value: Any) -> Tuple[str, ...]:
+    """Parse a comma-separated string or an Airtable multi-select into interned tags"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(intern(str(tag).strip()) for tag in value if str(tag).strip())
+
+
+class ProductStore:
+    """
+    Products of one catalog version, parsed once into typed columns.
+
+    Products are addressed by ordinal (their position in `records`). Prices
+    are floats in an `array('d')` (NaN when unknown), categories are interned
+    and stored as integer codes, tags as interned tuples. Heavy text columns
+    such as Description are loaded on first use through `column_loader`.
+    `content_hash` identifies the catalog content the store was built from.
+    `analyzer` tokenizes text columns for the keyword index; queries must go
+    through the same analyzer.
+
+    Filters are also available as bitmaps over ordinals (see bitmap.py),
+    built on first use, so several filters combine with a few `&` / `|`.
+
+    A store is never modified once built: apply_changes() derives the store
+    of the next catalog version from a delta. Replaced and deleted products
+    leave tombstones (ordinals no index returns) until the catalog is
+    rebuilt from scratch, which compacts the ordinals again.
+    """
+
+    def __init__(
+        self,
+        records: List[Dict[str, Any]],
+        version: int = 0,
+        column_loader: Optional[Callable[[List[Dict[str, Any]], str], List[Any]]] = None,
+        content_hash: str = "",
+        analyzer: Optional[FrenchAnalyzer] = None
+    ):
+        self.version = version
+        self.content_hash = content_hash
+        self.analyzer = analyzer if analyzer is not None else DEFAULT_ANALYZER
+        self.records = records
+        self._column_loader = column_loader
+
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.prices = array("d")
+        self.category_codes = array("l")
+        self.categories: List[str] = []
+        self.tags: List[Tuple[str, ...]] = []
+
+        self._category_index: Dict[str, int] = {}
+        for record in records:
+            self._append_columns(record)
+
+        # Category index: normalized name -> ordinals (ascending), so "Cuisine"
+        # and "cuisine" share one postings list
+        postings: Dict[str, array] = {}
+        codes_by_key: Dict[str, Set[int]] = {}
+        for code, category in enumerate(self.categories):
+            codes_by_key.setdefault(normalize_text(category), set()).add(code)
+        key_by_code = {code: key for key, codes in codes_by_key.items() for code in codes}
+        for ordinal, code in enumerate(self.category_codes):
+            if code != NO_CATEGORY:
+                key = key_by_code[code]
+                if key not in postings:
+                    postings[key] = array("l")
+                postings[key].append(ordinal)
+        self._category_postings = postings
+        self._category_codes_by_key = codes_by_key
+
+        # Category listing, sorted once: each normalized category is shown under
+        # its most frequent spelling, with its product count
+        spelling_counts: Dict[int, int] = {}
+        for code in self.category_codes:
+            if code != NO_CATEGORY:
+                spelling_counts[code] = spelling_counts.get(code, 0) + 1
+        self._category_spelling_counts = spelling_counts
+        self._list_categories()
+
+        # Price index: ordinals sorted by price (unknown prices left out)
+        price_order = sorted(
+            (ordinal for ordinal, price in enumerate(self.prices) if not math.isnan(price)),
+            key=self.prices.__getitem__
+        )
+        self._price_order = array("l", price_order)
+        self._sorted_prices = array("d", (self.prices[ordinal] for ordinal in price_order))
+
+        self._columns: Dict[str, List[Any]] = {"id": self.ids, "Name": self.names}
+        self._indexes: Dict[Tuple, Any] = {}
+        self._bitmaps: Dict[str, Any] = {}
+        # Lazy columns, indexes and bitmaps may be built from a worker thread
+        # (search indexing, compaction) while requests use the store (see _cached)
+        self._lock = threading.Lock()
+
+        # Tombstones left by apply_changes, and when the first delta was applied
+        self._deleted = bitmap.EMPTY
+        self.tombstones = 0
+        self.changed_at: Optional[float] = None
+        self._ordinals_by_id: Optional[Dict[str, int]] = None
+
+    def _append_columns(self, record: Dict[str, Any]):
+        """Parse one record into the typed columns (not into `records`)"""
+        self.ids.append(record.get("id"))
+        self.names.append(str(record.get("Name", record.get("name", "")) or ""))
+        self.prices.append(parse_price(record.get("Price", record.get("price"))))
+
+        category = record.get("Category", record.get("category"))
+        if category:
+            category = intern(str(category).strip())
+            code = self._category_index.get(category)
+            if code is None:
+                code = self._category_index[category] = len(self.categories)
+                self.categories.append(category)
+            self.category_codes.append(code)
+        else:
+            self.category_codes.append(NO_CATEGORY)
+
+        self.tags.append(parse_tags(record.get("Tags", record.get("tags"))))
+
+    def _list_categories(self):
+        """Sorted category listing and display names, from the postings and spelling counts"""
+        spelling_counts = self._category_spelling_counts
+        listing = []
+        for key, codes in self._category_codes_by_key.items():
+            count = len(self._category_postings.get(key, ()))
+            if not count:
+                continue
+            # Most frequent spelling, ties broken on the text so that a delta
+            # store and a rebuild of the same products agree
+            display = min(codes, key=lambda code: (-spelling_counts.get(code, 0), self.categories[code]))
+            listing.append((key, self.categories[display], count))
+        listing.sort()
+        self.category_counts: List[Tuple[str, int]] = [(name, count) for _, name, count in listing]
+        self._category_names = {key: name for key, name, _ in listing}
+
+    def __len__(self) -> int:
+        """Number of products, tombstones excluded (ordinals span len(records))"""
+        return self.live_count
+
+    def records_for(self, ordinals: Iterable[int]) -> List[Dict[str, Any]]:
+        """Return the raw records of the given ordinals, in order"""
+        records = self.records
+        return [records[ordinal] for ordinal in ordinals]
+
+    def _cached(self, cache: Dict, key: Any, value: Any) -> Any:
+        """Publish a lazily built value in `cache`, or return the one another thread published first"""
+        with self._lock:
+            return cache.setdefault(key, value)
+
+    def column(self, field: str) -> List[Any]:
+        """Return a whole column by field name, loading heavy columns on first use"""
+        field = canonical_field(field)
+        values = self._columns.get(field)
+        if values is None:
+            if self._column_loader is not None and self.records and field not in self.records[0]:
+                values = self._column_loader(self.records, field)
+            else:
+                values = [record.get(field) for record in self.records]
+            values = self._cached(self._columns, field, values)
+        return values
+
+    def text_column(self, field: str) -> List[str]:
+        """Column as normalized text (cached), for matching"""
+        key = f"normalized:{canonical_field(field)}"
+        values = self._columns.get(key)
+        if values is None:
+            values = [normalize_text(str(value)) if value is not None else "" for value in self.column(field)]
+            values = self._cached(self._columns, key, values)
+        return values
+
+    def token_column(self, field: str) -> List[Tuple[str, ...]]:
+        """Column as analyzed tokens (cached), computed once per product"""
+        key = f"tokens:{canonical_field(field)}"
+        values = self._columns.get(key)
+        if values is None:
+            analyze = self.analyzer.analyze
+            values = [tuple(analyze(value)) if value is not None else () for value in self.column(field)]
+            values = self._cached(self._columns, key, values)
+        return values
+
+    def inverted_index(
+        self,
+        fields: Sequence[str],
+        boosts: Optional[Mapping[str, float]] = None
+    ) -> InvertedIndex:
+        """Inverted index over `fields`, built on first use for this catalog version"""
+        fields = tuple(sorted({canonical_field(field) for field in fields}))
+        key = (fields, tuple(sorted(boosts.items())) if boosts else None)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._cached(self._indexes, key, InvertedIndex(self, fields, boosts))
+        return index
+
+    def trigram_index(self, field: str) -> TrigramIndex:
+        """Trigram index over `field`, built on first use for this catalog version"""
+        key = ("trigram", canonical_field(field))
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._cached(self._indexes, key, TrigramIndex(self, key[1]))
+        return index
+
+    def suggestion_index(self, fields: Sequence[str] = SUGGESTION_FIELDS) -> SuggestionIndex:
+        """Autocomplete index over `fields`, built on first use for this catalog version"""
+        key = ("suggestion",) + tuple(canonical_field(field) for field in fields)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._cached(self._indexes, key, SuggestionIndex(self, key[1:]))
+        return index
+
+    def spelling_index(self, fields: Sequence[str]) -> SpellingIndex:
+        """Spelling correction dictionary over `fields`, built on first use for this catalog version"""
+        key = ("spelling",) + tuple(sorted({canonical_field(field) for field in fields}))
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._cached(self._indexes, key, SpellingIndex(self, key[1:]))
+        return index
+
+    def all_ordinals(self) -> Sequence[int]:
+        """Every live ordinal of the store (tombstones excluded), ascending"""
+        if not self.tombstones:
+            return range(len(self.records))
+        return bitmap.to_ordinals(self.all_bitmap())
+
+    @property
+    def live_count(self) -> int:
+        """Number of products (tombstones excluded)"""
+        return len(self.records) - self.tombstones
+
+    def price_range(
+        self,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None
+    ) -> array:
+        """Ordinals priced within [min_value, max_value], cheapest first: two bisects and a slice"""
+        low = 0 if min_value is None else bisect_left(self._sorted_prices, min_value)
+        high = len(self._sorted_prices) if max_value is None else bisect_right(self._sorted_prices, max_value)
+        return self._price_order[low:high]
+
+    def price_between(
+        self,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+        ordinals: Optional[Iterable[int]] = None
+    ) -> List[int]:
+        """
+        Ordinals whose price is within [min_value, max_value] (unknown prices excluded).
+
+        Without `ordinals` the result comes straight from the price index, in
+        ascending price order. A set of ordinals (output of another filter) is
+        probed while walking the index slice; any other sequence keeps its
+        own order and is checked against the parsed price column.
+        """
+        if ordinals is None:
+            return self.price_range(min_value, max_value).tolist()
+        if isinstance(ordinals, (set, frozenset)):
+            return [ordinal for ordinal in self.price_range(min_value, max_value) if ordinal in ordinals]
+
+        low = -math.inf if min_value is None else min_value
+        high = math.inf if max_value is None else max_value
+        prices = self.prices
+        return [ordinal for ordinal in ordinals if low <= prices[ordinal] <= high]
+
+    def matching_category_codes(self, category: str) -> Set[int]:
+        """Codes of the categories equal to `category`, ignoring case and accents"""
+        return self._category_codes_by_key.get(normalize_text(category), set())
+
+    def category_postings(self, category: str) -> array:
+        """Ordinals (ascending) whose category equals `category`, ignoring case and accents"""
+        return self._category_postings.get(normalize_text(category), array("l"))
+
+    def in_categories(
+        self,
+        categories: Sequence[str],
+        ordinals: Optional[Iterable[int]] = None
+    ) -> List[int]:
+        """
+        Ordinals whose category is one of `categories`.
+
+        Without `ordinals` the result is read from the postings index, in
+        catalog order; otherwise `ordinals` keeps its own order.
+        """
+        if ordinals is None:
+            keys = {normalize_text(category) for category in categories}
+            lists = [self._category_postings[key] for key in keys if key in self._category_postings]
+            if len(lists) == 1:
+                return lists[0].tolist()
+            return sorted(ordinal for postings in lists for ordinal in postings)
+
+        codes = set()
+        for category in categories:
+            codes |= self.matching_category_codes(category)
+        category_codes = self.category_codes
+        return [ordinal for ordinal in ordinals if category_codes[ordinal] in codes]
+
+    def all_bitmap(self) -> int:
+        """Bitmap of every product (tombstones excluded)"""
+        return bitmap.full(len(self.records)) & ~self._deleted
+
+    def category_bitmap(self, categories: Sequence[str]) -> int:
+        """Bitmap of the products whose category is one of `categories`, ignoring case and accents"""
+        bitmaps = self._category_bitmaps()
+        return bitmap.union(bitmaps.get(normalize_text(category), bitmap.EMPTY) for category in categories)
+
+    def category_facets(self) -> List[Tuple[str, int]]:
+        """(display name, bitmap) of every category, in category_counts order"""
+        bitmaps = self._category_bitmaps()
+        return [(name, bitmaps[key]) for key, name in self._category_names.items()]
+
+    def _category_bitmaps(self) -> Dict[str, int]:
+        """Normalized category -> bitmap, built on first use"""
+        bitmaps = self._bitmaps.get("categories")
+        if bitmaps is None:
+            size = len(self.records)
+            bitmaps = self._cached(self._bitmaps, "categories", {
+                key: bitmap.from_ordinals(postings, size) for key, postings in self._category_postings.items()
+            })
+        return bitmaps
+
+    def tag_bitmap(self, tags: Sequence[str]) -> int:
+        """Bitmap of the products carrying any of `tags`, ignoring case and accents"""
+        bitmaps = self._tag_bitmaps()
+        return bitmap.union(bitmaps.get(normalize_text(tag), bitmap.EMPTY) for tag in tags)
+
+    def tag_facets(self) -> List[Tuple[str, int]]:
+        """(display name, bitmap) of every tag, sorted by normalized tag"""
+        bitmaps = self._tag_bitmaps()
+        names = self._bitmaps["tag_names"]
+        return [(names[key], bitmaps[key]) for key in sorted(bitmaps)]
+
+    def _tag_bitmaps(self) -> Dict[str, int]:
+        """Normalized tag -> bitmap, built on first use; each tag is shown under its most frequent spelling"""
+        bitmaps = self._bitmaps.get("tags")
+        if bitmaps is None:
+            postings: Dict[str, List[int]] = {}
+            spellings: Dict[str, Dict[str, int]] = {}
+            for ordinal in self.all_ordinals():
+                for tag in self.tags[ordinal]:
+                    key = normalize_text(tag)
+                    postings.setdefault(key, []).append(ordinal)
+                    counts = spellings.setdefault(key, {})
+                    counts[tag] = counts.get(tag, 0) + 1
+            size = len(self.records)
+            names = {key: min(counts, key=lambda tag: (-counts[tag], tag)) for key, counts in spellings.items()}
+            bitmaps = {key: bitmap.from_ordinals(ordinals, size) for key, ordinals in postings.items()}
+            with self._lock:
+                self._bitmaps.setdefault("tag_names", names)
+                bitmaps = self._bitmaps.setdefault("tags", bitmaps)
+        return bitmaps
+
+    def price_bitmap(self, min_value: Optional[float] = None, max_value: Optional[float] = None) -> int:
+        """
+        Bitmap of the products priced within [min_value, max_value] (unknown prices excluded).
+
+        Cumulative bitmaps of the products cheaper than PRICE_BITMAP_CHECKPOINTS
+        boundary prices are kept, so a range is the difference of two
+        prefixes, each a checkpoint plus the few products priced between
+        the checkpoint and the bound.
+        """
+        high = self._price_prefix(math.inf if max_value is None else max_value, inclusive=True)
+        if min_value is None or not high:
+            return high
+        return high & ~self._price_prefix(min_value, inclusive=False)
+
+    def _price_prefix(self, value: float, inclusive: bool) -> int:
+        """Bitmap of the products cheaper than `value` (or priced `value` when `inclusive`)"""
+        boundaries, checkpoints = self._price_checkpoints()
+        block = bisect_right(boundaries, value) - 1
+        end = (bisect_right if inclusive else bisect_left)(self._sorted_prices, value)
+        if block < 0:
+            base, start = bitmap.EMPTY, 0
+        else:
+            base, start = checkpoints[block], bisect_left(self._sorted_prices, boundaries[block])
+        if start >= end:
+            return base
+        return base | bitmap.from_ordinals(self._price_order[start:end], len(self.records))
+
+    def _price_checkpoints(self) -> Tuple[List[float], List[int]]:
+        """Boundary prices along the price index, and the bitmap of the products cheaper than each"""
+        cached = self._bitmaps.get("price")
+        if cached is None:
+            boundaries: List[float] = []
+            checkpoints: List[int] = []
+            running, start = bitmap.EMPTY, 0
+            step = max(1, -(-len(self._price_order) // PRICE_BITMAP_CHECKPOINTS))
+            for position in range(0, len(self._price_order), step):
+                boundary = self._sorted_prices[position]
+                first = bisect_left(self._sorted_prices, boundary)
+                running |= bitmap.from_ordinals(self._price_order[start:first], len(self.records))
+                start = first
+                boundaries.append(boundary)
+                checkpoints.append(running)
+            cached = self._cached(self._bitmaps, "price", (boundaries, checkpoints))
+        return cached
+
+    def _ordinal_index(self) -> Dict[str, int]:
+        """Record id -> live ordinal, built on first use"""
+        if self._ordinals_by_id is None:
+            ids = self.ids
+            self._ordinals_by_id = {ids[ordinal]: ordinal for ordinal in self.all_ordinals()}
+        return self._ordinals_by_id
+
+    def apply_changes(
+        self,
+        upserts: Sequence[Dict[str, Any]],
+        deleted_ids: Iterable[str] = (),
+        version: Optional[int] = None,
+        content_hash: Optional[str] = None
+    ) -> "ProductStore":
+        """
+        Store of the next catalog version: this one with `upserts` (new or
+        replaced products, full records) and `deleted_ids` applied.
+
+        Previous versions of replaced products and deleted products become
+        tombstones; new versions get new ordinals at the end. The new store
+        gets copies of this store's columns, extended with the new rows,
+        and takes over its id index; this store stays usable (and may still
+        be indexed from another thread) as it was. The structures already
+        built are then updated for the changed products only: category
+        postings and listing, price index and bitmaps, filter bitmaps,
+        inverted and trigram indexes. Suggestion and spelling dictionaries,
+        and BM25 statistics, stay those of the last full build until
+        compaction.
+
+        Cost: the changed products, the posting lists of their tokens
+        (copied before being edited), the columns, price arrays and filter
+        bitmaps (C-level copies and big-integer operations) and the token
+        dictionaries of the indexes; a few milliseconds for one product of
+        a 20k product catalog, so callers run it off the event loop.
+        """
+        started = time.perf_counter()
+        upserts = list({record.get("id"): record for record in upserts}.values())
+
+        store = copy.copy(self)
+        store.version = self.version if version is None else version
+        store.content_hash = self.content_hash if content_hash is None else content_hash
+
+        # What was built so far, read once: other threads may add to these
+        # caches meanwhile. The id index moves to the new store (rebuilt here
+        # if ever needed again)
+        columns, bitmaps, indexes = self._cache_snapshot()
+        with self._lock:
+            ordinals_by_id = self._ordinal_index()
+            self._ordinals_by_id = None
+        removed = []
+        for record_id in [*deleted_ids, *(record.get("id") for record in upserts)]:
+            ordinal = ordinals_by_id.pop(record_id, None)
+            if ordinal is not None:
+                removed.append(ordinal)
+
+        # Typed columns: the new versions appended (records belong to the catalog)
+        first = len(self.records)
+        store.records = self.records + upserts
+        store.ids = self.ids[:]
+        store.names = self.names[:]
+        store.prices = self.prices[:]
+        store.category_codes = self.category_codes[:]
+        store.tags = self.tags[:]
+        store.categories = list(self.categories)
+        store._category_index = dict(self._category_index)
+        for record in upserts:
+            store._append_columns(record)
+        added = list(range(first, len(store.records)))
+        for ordinal in added:
+            ordinals_by_id[store.ids[ordinal]] = ordinal
+
+        # Loaded and derived columns: raw values first, then normalized text and tokens
+        store._lock = threading.Lock()
+        store._columns = {"id": store.ids, "Name": store.names}
+        for key, values in columns.items():
+            if key not in store._columns:
+                store._columns[key] = values[:]
+        for key in sorted(store._columns, key=lambda key: key.count(":")):
+            if key in ("id", "Name"):
+                continue
+            kind, _, field = key.rpartition(":")
+            if not kind:
+                if self._column_loader is not None and upserts and field not in upserts[0]:
+                    new_values = self._column_loader(upserts, field)
+                else:
+                    new_values = [record.get(field) for record in upserts]
+            else:
+                raw = store.column(field)
+                if kind == "normalized":
+                    new_values = [normalize_text(str(raw[o])) if raw[o] is not None else "" for o in added]
+                else:
+                    analyze = self.analyzer.analyze
+                    new_values = [tuple(analyze(raw[o])) if raw[o] is not None else () for o in added]
+            store._columns[key].extend(new_values)
+
+        # Categories: postings, codes and spelling counts
+        postings = store._category_postings = dict(self._category_postings)
+        codes_by_key = store._category_codes_by_key = dict(self._category_codes_by_key)
+        spelling_counts = store._category_spelling_counts = dict(self._category_spelling_counts)
+        for code in range(len(self.categories), len(store.categories)):
+            key = normalize_text(store.categories[code])
+            codes_by_key[key] = codes_by_key.get(key, set()) | {code}
+        copied: Set[str] = set()
+
+        def category_posting(code: int) -> array:
+            key = normalize_text(store.categories[code])
+            if key not in copied:
+                postings[key] = postings[key][:] if key in postings else array("l")
+                copied.add(key)
+            return postings[key]
+
+        for ordinal in removed:
+            code = store.category_codes[ordinal]
+            if code != NO_CATEGORY:
+                category_posting(code).remove(ordinal)
+                spelling_counts[code] -= 1
+        for ordinal in added:
+            code = store.category_codes[ordinal]
+            if code != NO_CATEGORY:
+                category_posting(code).append(ordinal)
+                spelling_counts[code] = spelling_counts.get(code, 0) + 1
+        store._list_categories()
+
+        # Price index
+        store._price_order = self._price_order[:]
+        store._sorted_prices = self._sorted_prices[:]
+        for ordinal in removed:
+            price = store.prices[ordinal]
+            if not math.isnan(price):
+                position = bisect_left(store._sorted_prices, price)
+                while store._price_order[position] != ordinal:
+                    position += 1
+                del store._price_order[position]
+                del store._sorted_prices[position]
+        for ordinal in added:
+            price = store.prices[ordinal]
+            if not math.isnan(price):
+                position = bisect_right(store._sorted_prices, price)
+                store._price_order.insert(position, ordinal)
+                store._sorted_prices.insert(position, price)
+
+        # Tombstones, then the bitmaps and indexes already built
+        store._deleted = self._deleted | bitmap.from_ordinals(removed, first)
+        store.tombstones = self.tombstones + len(removed)
+        store.changed_at = self.changed_at if self.changed_at is not None else time.monotonic()
+        store._ordinals_by_id = ordinals_by_id
+        store._bitmaps = self._updated_bitmaps(store, bitmaps, removed, added)
+        # Indexes without updated() (suggestions, spelling) are shared as they are
+        store._indexes = {
+            key: index.updated(store, removed, added) if hasattr(index, "updated") else index
+            for key, index in indexes.items()
+        }
+
+        logger.info(
+            f"Applied delta to product store v{self.version} -> v{store.version}: "
+            f"{len(added)} upserted, {len(removed)} tombstoned ({store.tombstones} in total) "
+            f"in {time.perf_counter() - started:.4f}s"
+        )
+        return store
+
+    def _updated_bitmaps(
+        self,
+        store: "ProductStore",
+        bitmaps: Dict[str, Any],
+        removed: List[int],
+        added: List[int]
+    ) -> Dict[str, Any]:
+        """This store's filter `bitmaps` (a copy of the cache), updated for `store` (see apply_changes)"""
+
+        if "categories" in bitmaps:
+            categories = bitmaps["categories"] = dict(bitmaps["categories"])
+            for ordinals, add in ((removed, False), (added, True)):
+                for ordinal in ordinals:
+                    code = store.category_codes[ordinal]
+                    if code != NO_CATEGORY:
+                        key = normalize_text(store.categories[code])
+                        value = categories.get(key, bitmap.EMPTY)
+                        categories[key] = value | 1 << ordinal if add else value & ~(1 << ordinal)
+
+        if "tags" in bitmaps:
+            tags = bitmaps["tags"] = dict(bitmaps["tags"])
+            names = bitmaps["tag_names"] = dict(bitmaps["tag_names"])
+            for ordinal in removed:
+                for tag in store.tags[ordinal]:
+                    key = normalize_text(tag)
+                    value = tags[key] & ~(1 << ordinal)
+                    if value:
+                        tags[key] = value
+                    else:
+                        del tags[key]
+            for ordinal in added:
+                for tag in store.tags[ordinal]:
+                    key = normalize_text(tag)
+                    tags[key] = tags.get(key, bitmap.EMPTY) | 1 << ordinal
+                    names.setdefault(key, tag)
+
+        if "price" in bitmaps:
+            boundaries, checkpoints = bitmaps["price"]
+            checkpoints = list(checkpoints)
+            for ordinals, add in ((removed, False), (added, True)):
+                for ordinal in ordinals:
+                    price = store.prices[ordinal]
+                    if math.isnan(price):
+                        continue
+                    for block in range(bisect_right(boundaries, price), len(boundaries)):
+                        value = checkpoints[block]
+                        checkpoints[block] = value | 1 << ordinal if add else value & ~(1 << ordinal)
+            bitmaps["price"] = (boundaries, checkpoints)
+
+        return bitmaps
+
+    def needs_compaction(self) -> bool:
+        """
+        True when the store should be rebuilt from its live products:
+        tombstones reach COMPACTION_TOMBSTONE_RATIO of the ordinals, or the
+        first delta is older than COMPACTION_DELAY_SECONDS (stale dictionaries).
+        """
+        if self.changed_at is None:
+            return False
+        return (
+            self.tombstones >= COMPACTION_TOMBSTONE_RATIO * len(self.records)
+            or time.monotonic() - self.changed_at >= COMPACTION_DELAY_SECONDS
+        )
+
+    def compacted(self) -> "ProductStore":
+        """This catalog version rebuilt from its live products: no tombstones, fresh statistics"""
+        return ProductStore(
+            self.records_for(self.all_ordinals()),
+            version=self.version,
+            column_loader=self._column_loader,
+            content_hash=self.content_hash,
+            analyzer=self.analyzer
+        )
+
+    def memory_bytes(self) -> int:
+        """
+        Approximate size of the columns and indexes, records excluded (they
+        belong to the catalog). Estimated from the containers and a sample
+        of their items (see sizeof_items), so it costs a few milliseconds
+        whatever the catalog size; analyzed tokens are interned and counted
+        once, as index keys.
+        """
+        columns, bitmaps, indexes = self._cache_snapshot()
+        size = sum(sizeof_items(column) for column in columns.values())
+        size += sum(map(getsizeof, (self.prices, self.category_codes, self._price_order, self._sorted_prices)))
+        size += sizeof_items(self._category_postings)
+        for cached in bitmaps.values():
+            if isinstance(cached, tuple):
+                size += sum(sizeof_items(part) for part in cached)
+            else:
+                size += sizeof_items(cached)
+        return size + sum(index.memory_bytes() for index in indexes.values())
+
+    def _cache_snapshot(self) -> Tuple[Dict[str, List[Any]], Dict[str, Any], Dict[Tuple, Any]]:
+        """Copies of the lazy column, bitmap and index caches, safe to iterate while they grow"""
+        with self._lock:
+            return dict(self._columns), dict(self._bitmaps), dict(self._indexes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Store size information"""
+        columns, bitmaps, indexes = self._cache_snapshot()
+        return {
+            "version": self.version,
+            "content_hash": self.content_hash,
+            "products": self.live_count,
+            "tombstones": self.tombstones,
+            "categories": len(self.category_counts),
+            "priced": len(self._sorted_prices),
+            "loaded_columns": sorted(columns),
+            "bitmaps": sorted(bitmaps),
+            "indexes": [index.get_stats() for index in indexes.values()],
+        }
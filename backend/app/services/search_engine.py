@@ -1,158 +1,428 @@
 """Advanced search engine with semantic and keyword matching."""
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Tuple
 import re
+import math
+import time
+import heapq
+import threading
+from datetime import datetime, timezone
 from difflib import SequenceMatcher
 from app.core.utils import normalize_text
+from app.services import bitmap
+from app.services.product_store import ProductStore, canonical_field
+from app.services.search_index import FIELD_BOOSTS, SPELLING_MIN_LENGTH, WORD
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Filtered keyword search probes the postings by bisection when the
+# candidates are fewer than 1/BISECT_RATIO of the keyword matches
+BISECT_RATIO = 4
+
+# Price facet buckets: [low, high) in dollars, None for an open bound
+PRICE_FACETS = (
+    ("under_25", None, 25.0),
+    ("25_50", 25.0, 50.0),
+    ("50_100", 50.0, 100.0),
+    ("over_100", 100.0, None),
+)
+
+# Fields searched by /api/search, indexed when a generation is built
+SEARCH_FIELDS = ('name', 'description', 'category')
+
+
+class SearchGeneration:
+    """
+    Search indexes of one catalog version, built completely before publication.
+
+    The indexes (analyzed token columns, postings, price index and
+    bitmaps, category and tag bitmaps, suggestions, spelling dictionary)
+    live in the ProductStore and are built here eagerly, so requests
+    served by a published generation never pay for an index build. A store derived from a delta
+    carries its updated indexes over, so its generation is ready at once.
+    """
+
+    def __init__(self, number: int, store: ProductStore, field_boosts: Dict[str, float],
+                 prebuilt_seconds: float = 0.0):
+        started = time.perf_counter()
+        self.number = number
+        self.store = store
+        self.version = store.version
+        self.content_hash = store.content_hash
+
+        self.build_indexes(store, field_boosts)
+
+        self.build_seconds = prebuilt_seconds + time.perf_counter() - started
+        self.built_at = datetime.now(timezone.utc)
+        logger.info(
+            f"Built search generation {number} for catalog v{self.version} "
+            f"({store.live_count} products) in {self.build_seconds:.3f}s"
+        )
+
+    @staticmethod
+    def build_indexes(store: ProductStore, field_boosts: Dict[str, float]):
+        """Build the indexes served by a generation (no-op for those already built)"""
+        store.inverted_index(SEARCH_FIELDS, field_boosts)
+        store.suggestion_index()
+        store.spelling_index(SEARCH_FIELDS)
+        store.category_facets()
+        store.tag_facets()
+        store.price_bitmap()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate size of the generation's columns and indexes (see ProductStore.memory_bytes)"""
+        return self.store.memory_bytes()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Generation information"""
+        return {
+            "generation": self.number,
+            "catalog_version": self.version,
+            "content_hash": self.content_hash,
+            "products": self.store.live_count,
+            "tombstones": self.store.tombstones,
+            "build_seconds": round(self.build_seconds, 4),
+            "built_at": self.built_at.isoformat(),
+            "memory_bytes": self.memory_bytes,
+            "indexes": self.store.get_stats()["indexes"],
+        }
+
 
 class SearchEngine:
-    """Advanced search with multiple matching strategies."""
-    
+    """Advanced search with multiple matching strategies.
+
+    Every method works on a ProductStore and addresses products by ordinal;
+    `ordinals` restricts a search to the output of a previous filter.
+    """
+
     def __init__(self):
         self.min_score = 0.3  # 30% minimum match score
-    
-    def keyword_search(self, query: str, items: List[Dict[str, Any]], 
-                       search_fields: List[str]) -> List[tuple]:
+        self.field_boosts = dict(FIELD_BOOSTS)  # BM25F weight of each field
+        self._generation: Optional[SearchGeneration] = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def generation(self) -> Optional[SearchGeneration]:
+        """Published generation (None before the first catalog is indexed)"""
+        return self._generation
+
+    def use(self, store: ProductStore) -> SearchGeneration:
         """
-        Search items using keyword matching.
-        Returns: List of (item, score) tuples sorted by score.
+        Generation to serve a request for `store`.
+
+        The read path is a single attribute read: when `store` is already
+        the published one it is returned without locking. A newer catalog
+        version is indexed once (concurrent callers wait for that build),
+        then published by swapping the reference, so in-flight requests
+        keep the generation they started with. A store older than the
+        published one (or replaced by its compacted copy) gets the
+        published generation.
         """
-        query_normalized = normalize_text(query)
-        query_words = set(query_normalized.split())
-        
-        results = []
-        for item in items:
-            item_text = " ".join([
-                normalize_text(str(item.get(field, "")))
-                for field in search_fields
-            ])
-            item_words = set(item_text.split())
-            
-            # Calculate word overlap
-            overlap = len(query_words & item_words)
-            score = overlap / len(query_words) if query_words else 0
-            
-            if score >= self.min_score:
-                results.append((item, score))
-        
-        # Sort by score descending
-        results.sort(key=lambda x: x[1], reverse=True)
+        generation = self._generation
+        if generation is not None and generation.store is store:
+            return generation
+
+        with self._build_lock:
+            generation = self._generation
+            if generation is not None and (generation.store is store or generation.version >= store.version):
+                return generation
+            number = generation.number + 1 if generation is not None else 1
+            generation = SearchGeneration(number, store, self.field_boosts)
+            self._generation = generation
+            return generation
+
+    def compact(self, store: ProductStore) -> Optional[SearchGeneration]:
+        """
+        Rebuild `store` from its live products (no tombstones, fresh BM25
+        statistics and dictionaries) and publish it as a new generation.
+
+        The rebuild runs outside the build lock; if another store was
+        published meanwhile the compacted one is dropped and None returned.
+        """
+        started = time.perf_counter()
+        compacted = store.compacted()
+        SearchGeneration.build_indexes(compacted, self.field_boosts)
+
+        with self._build_lock:
+            generation = self._generation
+            if generation is None or generation.store is not store:
+                logger.info(f"Dropped compaction of catalog v{store.version}: superseded")
+                return None
+            generation = SearchGeneration(
+                generation.number + 1, compacted, self.field_boosts,
+                prebuilt_seconds=time.perf_counter() - started
+            )
+            self._generation = generation
+            return generation
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Published generation information"""
+        generation = self._generation
+        if generation is None:
+            return {"generation": 0}
+        return generation.get_stats()
+
+    def keyword_search(self, query: str, store: ProductStore,
+                       search_fields: List[str],
+                       ordinals: Optional[Iterable[int]] = None) -> List[tuple]:
+        """
+        Search items using keyword matching, ranked by BM25 from the inverted index.
+        Only products containing at least `min_score` of the query words are kept;
+        cost follows the postings of the query words, not the catalog size.
+        Returns: List of (ordinal, score) tuples sorted by score.
+        """
+        results = self._keyword_matches(query, store, search_fields, ordinals)
+
+        # Sort by score descending, catalog order between ties
+        results.sort(key=self._rank_key)
         return results
-    
-    def fuzzy_search(self, query: str, items: List[Dict[str, Any]], 
-                     search_field: str) -> List[tuple]:
+
+    @staticmethod
+    def _rank_key(result: tuple) -> tuple:
+        """Score descending, catalog order between ties"""
+        return -result[1], result[0]
+
+    def _keyword_matches(self, query: str, store: ProductStore,
+                         search_fields: List[str],
+                         ordinals: Optional[Iterable[int]] = None,
+                         filter_bitmaps: Optional[List[int]] = None) -> List[tuple]:
+        """
+        Unsorted (ordinal, BM25 score) pairs of the products matching the query.
+        With `filter_bitmaps`, the postings bitmap of the query words is
+        intersected with the filters (most selective first) before scoring.
+        """
+        # Same analyzer as the index: stop-words dropped, plurals/feminines stemmed
+        query_words = set(store.analyzer.analyze(query))
+        if not query_words:
+            return []
+
+        index = store.inverted_index(search_fields, self.field_boosts)
+        allowed = None
+        if filter_bitmaps:
+            matching = index.bitmap(query_words, self._min_hits(len(query_words)))
+            candidates = bitmap.intersect(filter_bitmaps + [matching])
+            if not candidates:
+                return []
+            # Few candidates: probe the postings; most matches kept: plain scoring
+            if bitmap.count(candidates) * BISECT_RATIO < bitmap.count(matching):
+                scores = index.score_ordinals(query_words, bitmap.to_ordinals(candidates))
+                return self._filter_hits(scores, len(query_words))
+            if candidates != matching:
+                allowed = set(bitmap.to_ordinals(candidates))
+        elif ordinals is not None:
+            allowed = ordinals if isinstance(ordinals, (set, frozenset)) else set(ordinals)
+        return self._filter_hits(index.score(query_words, allowed), len(query_words))
+
+    def _min_hits(self, word_count: int) -> int:
+        """Number of query words a product must contain to match"""
+        return math.ceil(self.min_score * word_count)
+
+    def _filter_hits(self, scores: Dict[int, Tuple[int, float]], word_count: int) -> List[tuple]:
+        """(ordinal, score) pairs of the products containing enough of the query words"""
+        # Word overlap decides what matches, BM25 how it ranks
+        min_hits = self._min_hits(word_count)
+        return [
+            (ordinal, score) for ordinal, (hits, score) in scores.items()
+            if hits >= min_hits
+        ]
+
+    def correct_query(self, query: str, store: ProductStore,
+                      search_fields: List[str]) -> Tuple[str, Dict[str, str]]:
+        """
+        Correct query words unknown to the catalog (SymSpell dictionary).
+        A word is known when it, or its stem, is in the catalog vocabulary;
+        stop-words, numbers and very short words are left alone.
+        Returns: (corrected query, {typed word: correction})
+        """
+        words = WORD.findall(normalize_text(query))
+        index = store.inverted_index(search_fields, self.field_boosts)
+        analyzer = store.analyzer
+
+        corrections: Dict[str, str] = {}
+        spelling = None
+        for word in words:
+            if (word in corrections or len(word) < SPELLING_MIN_LENGTH or word.isdigit()
+                    or word in analyzer.stop_words or analyzer.stem(word) in index.postings):
+                continue
+            if spelling is None:
+                spelling = store.spelling_index(search_fields)
+            correction = spelling.lookup(word)
+            if correction and correction != word:
+                corrections[word] = correction
+
+        if not corrections:
+            return query, {}
+        return " ".join(corrections.get(word, word) for word in words), corrections
+
+    def fuzzy_search(self, query: str, store: ProductStore,
+                     search_field: str,
+                     ordinals: Optional[Iterable[int]] = None,
+                     rescore: bool = False) -> List[tuple]:
         """
         Search items using fuzzy (similarity-based) matching.
-        Returns: List of (item, score) tuples.
+        Candidates come from the trigram index, scored by trigram Dice
+        similarity; with `rescore` the (small) candidate set is re-scored
+        with SequenceMatcher. Both scores are filtered by `min_score`.
+        Returns: List of (ordinal, score) tuples.
         """
         query_normalized = normalize_text(query)
-        results = []
-        
-        for item in items:
-            field_value = normalize_text(str(item.get(search_field, "")))
-            
-            # Calculate similarity ratio
-            ratio = SequenceMatcher(None, query_normalized, field_value).ratio()
-            
-            if ratio >= self.min_score:
-                results.append((item, ratio))
-        
-        results.sort(key=lambda x: x[1], reverse=True)
+        candidates = store.trigram_index(search_field).similar(query_normalized, self.min_score)
+        if ordinals is not None:
+            allowed = ordinals if isinstance(ordinals, (set, frozenset)) else set(ordinals)
+            candidates = {ordinal: score for ordinal, score in candidates.items() if ordinal in allowed}
+
+        if rescore:
+            column = store.text_column(search_field)
+            candidates = {
+                ordinal: SequenceMatcher(None, query_normalized, column[ordinal]).ratio()
+                for ordinal in candidates
+            }
+
+        results = [(ordinal, score) for ordinal, score in candidates.items() if score >= self.min_score]
+        results.sort(key=lambda x: (-x[1], x[0]))
         return results
-    
-    def range_search(self, items: List[Dict[str, Any]], field: str,
+
+    def range_search(self, store: ProductStore, field: str = 'price',
                      min_value: Optional[float] = None,
-                     max_value: Optional[float] = None) -> List[Dict[str, Any]]:
+                     max_value: Optional[float] = None,
+                     ordinals: Optional[Iterable[int]] = None) -> List[int]:
         """
-        Filter items by numeric range.
+        Filter items by numeric range, answered from the store's sorted price index.
         """
-        results = []
-        for item in items:
-            value = item.get(field)
-            if value is None:
-                continue
-            
-            try:
-                value = float(value)
-                if (min_value is None or value >= min_value) and \
-                   (max_value is None or value <= max_value):
-                    results.append(item)
-            except (ValueError, TypeError):
-                continue
-        
-        return results
-    
-    def category_search(self, items: List[Dict[str, Any]], field: str,
-                       categories: List[str]) -> List[Dict[str, Any]]:
+        if canonical_field(field) != 'Price':
+            raise ValueError(f"Unsupported range field: {field}")
+        return store.price_between(min_value, max_value, ordinals)
+
+    def category_search(self, store: ProductStore, categories: List[str],
+                        ordinals: Optional[Iterable[int]] = None) -> List[int]:
         """
         Filter items by categories.
         """
-        return [
-            item for item in items
-            if normalize_text(str(item.get(field, ""))) in 
-               [normalize_text(cat) for cat in categories]
-        ]
-    
-    def combined_search(self, query: str, items: List[Dict[str, Any]],
-                       filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return store.in_categories(categories, ordinals)
+
+    def filter_bitmaps(self, store: ProductStore, filters: Dict[str, Any]) -> Dict[str, int]:
+        """
+        One bitmap per active filter ('price', 'categories', 'tags'), to be
+        intersected; see combined_search for the filters format.
+        """
+        bitmaps = {}
+        if filters.get('price_min') is not None or filters.get('price_max') is not None:
+            bitmaps['price'] = store.price_bitmap(filters.get('price_min'), filters.get('price_max'))
+        if filters.get('categories'):
+            bitmaps['categories'] = store.category_bitmap(filters['categories'])
+        if filters.get('tags'):
+            bitmaps['tags'] = store.tag_bitmap(filters['tags'])
+        return bitmaps
+
+    def combined_search(self, query: str, store: ProductStore,
+                        filters: Optional[Dict[str, Any]] = None,
+                        skip: int = 0,
+                        limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
         """
         Combine keyword search with optional filters.
         Filters format: {
             'price_min': float,
             'price_max': float,
             'categories': List[str],
+            'tags': List[str],
             'search_fields': List[str]
         }
+        Filters and the query words' postings are bitmaps over ordinals,
+        intersected in selectivity order, so only products passing every
+        filter are scored.
+        Only the requested page is ordered (partial heap selection of the
+        best skip + limit matches) and materialized.
+        Returns: (page of items, total number of matches)
         """
         if not filters:
             filters = {}
-        
-        # Apply range filters first
-        results = items
-        if 'price_min' in filters or 'price_max' in filters:
-            results = self.range_search(
-                results,
-                field='price',
-                min_value=filters.get('price_min'),
-                max_value=filters.get('price_max')
-            )
-        
-        # Apply category filter
-        if 'categories' in filters and filters['categories']:
-            results = self.category_search(results, 'category', filters['categories'])
-        
-        # Apply keyword search
+
+        # Apply filters and keyword search in one intersection
         search_fields = filters.get('search_fields', ['name', 'description'])
-        search_results = self.keyword_search(query, results, search_fields)
-        
+        matches = self._keyword_matches(
+            query, store, search_fields, filter_bitmaps=list(self.filter_bitmaps(store, filters).values())
+        )
+        total = len(matches)
+
+        # Order only what is returned
+        if limit is None:
+            ranked = sorted(matches, key=self._rank_key)
+        else:
+            ranked = heapq.nsmallest(skip + limit, matches, key=self._rank_key)
+        page = ranked[skip:] if limit is None else ranked[skip:skip + limit]
+
         # Extract items (remove scores)
-        return [item for item, score in search_results]
-    
-    def suggest(self, query: str, items: List[Dict[str, Any]], 
-                field: str, limit: int = 5) -> List[str]:
+        return store.records_for(ordinal for ordinal, score in page), total
+
+    def facet_counts(self, query: str, store: ProductStore,
+                     filters: Optional[Dict[str, Any]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Number of matching products per category, price bucket and tag.
+
+        The products matching the query come from the postings bitmaps;
+        each facet value is then one AND and one bit count. A dimension's
+        counts ignore that dimension's own filter (the other filters apply),
+        so the other values stay selectable. Empty values are left out,
+        except for price buckets.
+        Returns: {'categories': [...], 'prices': [...], 'tags': [...]}
+        """
+        if not filters:
+            filters = {}
+
+        query_words = set(store.analyzer.analyze(query))
+        search_fields = filters.get('search_fields', ['name', 'description'])
+        matching = bitmap.EMPTY
+        if query_words:
+            index = store.inverted_index(search_fields, self.field_boosts)
+            matching = index.bitmap(query_words, self._min_hits(len(query_words)))
+        filter_bitmaps = self.filter_bitmaps(store, filters)
+
+        def base(dimension: str) -> int:
+            others = [value for key, value in filter_bitmaps.items() if key != dimension]
+            return bitmap.intersect(others + [matching])
+
+        def counted(values: List[Tuple[str, int]], matched: int) -> List[Dict[str, Any]]:
+            counts = [(name, bitmap.count(matched & value)) for name, value in values]
+            counts.sort(key=lambda item: (-item[1], normalize_text(item[0])))
+            return [{'value': name, 'count': count} for name, count in counts if count]
+
+        price_base = base('price')
+        prices = []
+        for name, low, high in PRICE_FACETS:
+            bucket = store.price_bitmap(low)
+            if high is not None:
+                bucket ^= store.price_bitmap(high)
+            prices.append({'value': name, 'min': low, 'max': high, 'count': bitmap.count(price_base & bucket)})
+
+        return {
+            'categories': counted(store.category_facets(), base('categories')),
+            'prices': prices,
+            'tags': counted(store.tag_facets(), base('tags')),
+        }
+
+    def suggest(self, query: str, store: ProductStore,
+                field: Optional[str] = None, limit: int = 5) -> List[str]:
         """
         Generate search suggestions based on query.
+        Completions of any word start of product names, tags and categories
+        (or of `field` only), most popular first.
         """
-        query_normalized = normalize_text(query)
-        suggestions = set()
-        
-        for item in items:
-            field_value = normalize_text(str(item.get(field, "")))
-            
-            # Check if field starts with query (strong match)
-            if field_value.startswith(query_normalized):
-                suggestions.add(field_value)
-            # Check if query is substring of field
-            elif query_normalized in field_value:
-                suggestions.add(field_value)
-        
-        return list(suggestions)[:limit]
+        index = store.suggestion_index([field]) if field else store.suggestion_index()
+        return index.complete(query, limit)
+
+
+# Global search engine instance (one per worker process)
+_search_engine = SearchEngine()
 
 
 def get_search_engine() -> SearchEngine:
-    """Get search engine instance."""
-    return SearchEngine()
+    """Get global search engine instance."""
+    return _search_engine
+
+
+def reset_search_engine():
+    """Drop every generation (for testing)."""
+    global _search_engine
+    _search_engine = SearchEngine()
@@ -0,0 +1,650 @@
+"""Search indexes over the text columns of a ProductStore"""
+
+import re
+import copy
+import math
+import time
+import heapq
+import logging
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from sys import getsizeof
+from typing import List, Dict, Any, Container, Iterable, Mapping, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+
+from app.core.utils import normalize_text, sizeof_items
+from app.services import bitmap
+
+if TYPE_CHECKING:
+    from app.services.product_store import ProductStore
+
+logger = logging.getLogger(__name__)
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Weight of a match in each field: a name match outranks a description match
+FIELD_BOOSTS = {
+    "Name": 3.0,
+    "Category": 2.0,
+    "Tags": 2.0,
+    "Description": 1.0,
+}
+
+# Autocomplete: phrase sources, completions kept per prefix, prefixes precomputed
+SUGGESTION_FIELDS = ("Name", "Tags", "Category")
+SUGGESTION_LIMIT = 10
+SUGGESTION_PRECOMPUTED_LENGTH = 3
+SUGGESTION_SCAN_LIMIT = 256
+
+# Spelling correction: edit distance, significant prefix, shortest word corrected
+SPELLING_MAX_DISTANCE = 2
+SPELLING_PREFIX_LENGTH = 7
+SPELLING_MIN_LENGTH = 3
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+class InvertedIndex:
+    """
+    Analyzed token -> posting list of product ordinals, with BM25 impacts.
+
+    Built once from the store's token columns (see text_analyzer); a product appears
+    at most once in a posting list even when the token occurs in several
+    of the indexed fields. Posting lists are ascending `array('l')`.
+
+    Scoring is BM25F: per-field term frequencies are length-normalized
+    against the field's average length, weighted by the field boost, then
+    saturated with k1 and multiplied by the token's idf. All of this only
+    depends on the catalog, so each posting stores its final impact and a
+    query just sums the impacts of its tokens' postings.
+
+    Tombstones of the store are not indexed; updated() derives the index of
+    the next store version from a delta.
+    """
+
+    def __init__(
+        self,
+        store: "ProductStore",
+        fields: Sequence[str],
+        boosts: Optional[Mapping[str, float]] = None,
+        k1: float = BM25_K1,
+        b: float = BM25_B
+    ):
+        started = time.perf_counter()
+        self.fields = tuple(fields)
+        self.boosts = {field: (boosts or FIELD_BOOSTS).get(field, 1.0) for field in self.fields}
+        self.k1 = k1
+        self.b = b
+        live = store.all_ordinals()
+        # Products indexed (BM25 document count), and ordinals spanned (bitmap width)
+        self.size = len(live)
+        self.width = len(store.records)
+
+        columns = [store.token_column(field) for field in self.fields]
+
+        # Field-length norms (over live products)
+        self.field_lengths: Dict[str, array] = {}
+        self.average_lengths: Dict[str, float] = {}
+        for field, column in zip(self.fields, columns):
+            lengths = array("l", (len(tokens) for tokens in column))
+            self.field_lengths[field] = lengths
+            total = sum(lengths) if len(live) == len(lengths) else sum(lengths[ordinal] for ordinal in live)
+            self.average_lengths[field] = (total / len(live) if live else 0.0) or 1.0
+
+        # Postings with the boosted, length-normalized term frequency
+        postings: Dict[str, array] = {}
+        weights: Dict[str, array] = {}
+        for ordinal in live:
+            for token, weight in self._weights(columns, ordinal).items():
+                posting = postings.get(token)
+                if posting is None:
+                    posting = postings[token] = array("l")
+                    weights[token] = array("d")
+                posting.append(ordinal)
+                weights[token].append(weight)
+
+        # Impacts: idf(token) * saturated weight
+        impacts: Dict[str, array] = {}
+        for token, posting in postings.items():
+            idf = self.idf(len(posting))
+            impacts[token] = array("d", (idf * w / (k1 + w) for w in weights[token]))
+
+        self.postings = postings
+        self.impacts = impacts
+        self._bitmaps: Dict[str, int] = {}
+        self.build_seconds = time.perf_counter() - started
+        logger.info(
+            f"Built inverted index on {', '.join(self.fields)}: "
+            f"{len(postings)} tokens, {self.posting_count()} postings in {self.build_seconds:.3f}s"
+        )
+
+    def _weights(self, columns: List[List[Tuple[str, ...]]], ordinal: int) -> Dict[str, float]:
+        """Boosted, length-normalized frequency of each token of one product"""
+        weighted: Dict[str, float] = {}
+        b = self.b
+        for field, column in zip(self.fields, columns):
+            tokens = column[ordinal]
+            if not tokens:
+                continue
+            boost = self.boosts[field]
+            norm = 1.0 - b + b * self.field_lengths[field][ordinal] / self.average_lengths[field]
+            for token, frequency in Counter(tokens).items():
+                weighted[token] = weighted.get(token, 0.0) + boost * frequency / norm
+        return weighted
+
+    def updated(self, store: "ProductStore", removed: Sequence[int], added: Sequence[int]) -> "InvertedIndex":
+        """
+        This index for the next version of the store (see ProductStore.apply_changes).
+
+        The `removed` ordinals leave the postings of their tokens and the
+        `added` ones (always the highest ordinals) are appended, so only the
+        posting lists of the changed products' tokens are copied. The
+        document count follows the store, so new impacts use the current
+        idf; average lengths and the impacts of unchanged products are only
+        refreshed by a full rebuild.
+        """
+        index = copy.copy(self)
+        index.size = store.live_count
+        index.width = len(store.records)
+        index.postings = dict(self.postings)
+        index.impacts = dict(self.impacts)
+        columns = [store.token_column(field) for field in self.fields]
+        index.field_lengths = {}
+        for field, column in zip(self.fields, columns):
+            lengths = index.field_lengths[field] = array("l", self.field_lengths[field])
+            lengths.extend(len(column[ordinal]) for ordinal in added)
+
+        touched: Set[str] = set()
+
+        def editable(token: str) -> Tuple[array, array]:
+            if token not in touched:
+                if token in index.postings:
+                    index.postings[token] = index.postings[token][:]
+                    index.impacts[token] = index.impacts[token][:]
+                else:
+                    index.postings[token] = array("l")
+                    index.impacts[token] = array("d")
+                touched.add(token)
+            return index.postings[token], index.impacts[token]
+
+        for ordinal in removed:
+            for token in {token for column in columns for token in column[ordinal]}:
+                posting, token_impacts = editable(token)
+                position = bisect_left(posting, ordinal)
+                if position < len(posting) and posting[position] == ordinal:
+                    del posting[position]
+                    del token_impacts[position]
+        for ordinal in added:
+            for token, weight in index._weights(columns, ordinal).items():
+                posting, token_impacts = editable(token)
+                posting.append(ordinal)
+                token_impacts.append(index.idf(len(posting)) * weight / (self.k1 + weight))
+
+        for token in touched:
+            if not index.postings[token]:
+                del index.postings[token], index.impacts[token]
+        # Copied first: requests may add token bitmaps to this index meanwhile
+        bitmaps = dict(self._bitmaps)
+        index._bitmaps = {token: value for token, value in bitmaps.items() if token not in touched}
+        return index
+
+    def idf(self, document_frequency: int) -> float:
+        """BM25 inverse document frequency (never negative)"""
+        return math.log(1.0 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def posting(self, token: str) -> array:
+        """Ordinals containing `token` (empty when unknown)"""
+        return self.postings.get(token, array("l"))
+
+    def bitmap(self, tokens: Iterable[str], min_hits: int = 1) -> int:
+        """
+        Bitmap of the products containing at least `min_hits` of `tokens`
+        (any of them by default). Per-token bitmaps are built on first use,
+        for indexed tokens only (the cache is bounded by the vocabulary,
+        not by what users type); levels[j] holds the products seen with at
+        least j + 1 tokens so far.
+        """
+        bitmaps, postings = self._bitmaps, self.postings
+        levels = [bitmap.EMPTY] * max(1, min_hits)
+        for token in set(tokens):
+            token_bitmap = bitmaps.get(token)
+            if token_bitmap is None:
+                posting = postings.get(token)
+                if posting is None:
+                    continue
+                token_bitmap = bitmaps[token] = bitmap.from_ordinals(posting, self.width)
+            for level in range(len(levels) - 1, 0, -1):
+                levels[level] |= levels[level - 1] & token_bitmap
+            levels[0] |= token_bitmap
+        return levels[-1]
+
+    def score(self, tokens: Iterable[str],
+              allowed: Optional[Container[int]] = None) -> Dict[int, Tuple[int, float]]:
+        """
+        BM25 score of every product matching at least one token.
+
+        Returns {ordinal: (matched token count, score)}; only the postings
+        of the query tokens are visited, and only the `allowed` ordinals
+        are scored when given.
+        """
+        scores: Dict[int, Tuple[int, float]] = {}
+        get = scores.get
+        for token in set(tokens):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            for ordinal, impact in zip(posting, self.impacts[token]):
+                if allowed is not None and ordinal not in allowed:
+                    continue
+                hits, total = get(ordinal, (0, 0.0))
+                scores[ordinal] = (hits + 1, total + impact)
+        return scores
+
+    def score_ordinals(self, tokens: Iterable[str], ordinals: Sequence[int]) -> Dict[int, Tuple[int, float]]:
+        """
+        Same as score(), restricted to `ordinals` (ascending) and looked up
+        by bisection in each posting list: cheaper than score() when the
+        ordinals are few compared to the postings.
+        """
+        scores: Dict[int, Tuple[int, float]] = {}
+        get = scores.get
+        for token in set(tokens):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            token_impacts = self.impacts[token]
+            end = len(posting)
+            position = 0
+            for ordinal in ordinals:
+                position = bisect_left(posting, ordinal, position, end)
+                if position == end:
+                    break
+                if posting[position] == ordinal:
+                    hits, total = get(ordinal, (0, 0.0))
+                    scores[ordinal] = (hits + 1, total + token_impacts[position])
+        return scores
+
+    def posting_count(self) -> int:
+        """Total number of (token, product) entries"""
+        return sum(len(posting) for posting in self.postings.values())
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the postings, impacts, length norms and cached bitmaps"""
+        return (sizeof_items(self.postings) + sizeof_items(self.impacts, keys=False)
+                + sizeof_items(self.field_lengths) + sizeof_items(self._bitmaps, keys=False))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size information"""
+        return {
+            "fields": list(self.fields),
+            "boosts": self.boosts,
+            "tokens": len(self.postings),
+            "postings": self.posting_count(),
+            "bitmaps": len(self._bitmaps),
+            "build_seconds": round(self.build_seconds, 4),
+        }
+
+
+def trigrams(text: str) -> Set[str]:
+    """Character trigrams of each word, padded like pg_trgm ("  mot ")"""
+    grams: Set[str] = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Character trigram -> posting list of product ordinals, for typo tolerance.
+
+    Candidates are retrieved by the number of trigrams they share with the
+    query and scored with the Dice coefficient
+    2 * shared / (query trigrams + product trigrams), so only products
+    sharing at least one trigram with the query are ever looked at.
+    """
+
+    def __init__(self, store: "ProductStore", field: str):
+        started = time.perf_counter()
+        self.field = field
+        live = store.all_ordinals()
+        self.size = len(live)
+
+        postings: Dict[str, array] = {}
+        column = store.text_column(field)
+        self.gram_counts = array("l", [0]) * len(column)
+        for ordinal in live:
+            grams = trigrams(column[ordinal])
+            self.gram_counts[ordinal] = len(grams)
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("l")
+                posting.append(ordinal)
+
+        self.postings = postings
+        self.build_seconds = time.perf_counter() - started
+        logger.info(
+            f"Built trigram index on {field}: {len(postings)} trigrams in {self.build_seconds:.3f}s"
+        )
+
+    def updated(self, store: "ProductStore", removed: Sequence[int], added: Sequence[int]) -> "TrigramIndex":
+        """This index for the next version of the store: only the changed products' trigram postings are copied"""
+        index = copy.copy(self)
+        index.postings = dict(self.postings)
+        index.gram_counts = self.gram_counts[:]
+        column = store.text_column(self.field)
+
+        touched: Set[str] = set()
+
+        def editable(gram: str) -> array:
+            if gram not in touched:
+                index.postings[gram] = index.postings[gram][:] if gram in index.postings else array("l")
+                touched.add(gram)
+            return index.postings[gram]
+
+        for ordinal in removed:
+            for gram in trigrams(column[ordinal]):
+                posting = editable(gram)
+                position = bisect_left(posting, ordinal)
+                if position < len(posting) and posting[position] == ordinal:
+                    del posting[position]
+        for ordinal in added:
+            grams = trigrams(column[ordinal])
+            index.gram_counts.append(len(grams))
+            for gram in grams:
+                editable(gram).append(ordinal)
+
+        for gram in touched:
+            if not index.postings[gram]:
+                del index.postings[gram]
+        index.size = store.live_count
+        return index
+
+    def similar(self, text: str, min_score: float = 0.0) -> Dict[int, float]:
+        """Dice similarity of every product sharing a trigram with `text`, at least `min_score`"""
+        query_grams = trigrams(text)
+        if not query_grams:
+            return {}
+
+        shared: Dict[int, int] = {}
+        get = shared.get
+        for gram in query_grams:
+            for ordinal in self.postings.get(gram, ()):
+                shared[ordinal] = get(ordinal, 0) + 1
+
+        query_count = len(query_grams)
+        gram_counts = self.gram_counts
+        results = {}
+        for ordinal, count in shared.items():
+            score = 2.0 * count / (query_count + gram_counts[ordinal])
+            if score >= min_score:
+                results[ordinal] = score
+        return results
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the postings and trigram counts"""
+        return sizeof_items(self.postings) + getsizeof(self.gram_counts)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size information"""
+        return {
+            "field": self.field,
+            "trigrams": len(self.postings),
+            "postings": sum(len(posting) for posting in self.postings.values()),
+            "build_seconds": round(self.build_seconds, 4),
+        }
+
+
+class SuggestionIndex:
+    """
+    Autocomplete over normalized product names, tags and categories.
+
+    Every phrase is indexed from each of its word starts ("casque bluetooth"
+    is found by "cas" and by "blue") in a sorted key array, so a prefix is a
+    bisect range. Phrases are ranked by popularity: the number of products
+    carrying them. Top-k completions of short prefixes and of any prefix
+    with a wide range are precomputed; other prefixes only rank their
+    small range.
+    """
+
+    def __init__(
+        self,
+        store: "ProductStore",
+        fields: Sequence[str] = SUGGESTION_FIELDS,
+        limit: int = SUGGESTION_LIMIT,
+        precomputed_length: int = SUGGESTION_PRECOMPUTED_LENGTH
+    ):
+        started = time.perf_counter()
+        self.fields = tuple(fields)
+        self.limit = limit
+        self.precomputed_length = precomputed_length
+
+        # Phrase -> (display text, popularity)
+        phrases: Dict[str, Tuple[str, int]] = {}
+
+        def add(display: str, count: int = 1):
+            normalized = " ".join(normalize_text(display).split())
+            if normalized:
+                current, popularity = phrases.get(normalized, (display, 0))
+                phrases[normalized] = (current, popularity + count)
+
+        for field in self.fields:
+            if field == "Category":
+                for name, count in store.category_counts:
+                    add(name, count)
+            elif field == "Tags":
+                for ordinal in store.all_ordinals():
+                    for tag in store.tags[ordinal]:
+                        add(tag)
+            else:
+                column = store.column(field)
+                for ordinal in store.all_ordinals():
+                    value = column[ordinal]
+                    if value:
+                        add(str(value))
+
+        self.displays: List[str] = []
+        popularity = array("l")
+        entries: List[Tuple[str, int, int]] = []
+        for phrase_id, (normalized, (display, count)) in enumerate(phrases.items()):
+            self.displays.append(display)
+            popularity.append(count)
+            words = normalized.split()
+            for position in range(len(words)):
+                entries.append((" ".join(words[position:]), phrase_id, position))
+        entries.sort()
+
+        self.keys = [key for key, _, _ in entries]
+        self.phrase_ids = array("l", (phrase_id for _, phrase_id, _ in entries))
+        self.positions = array("l", (position for _, _, position in entries))
+        self.popularity = popularity
+
+        # Top-k completions of every short prefix and of every prefix whose
+        # range is wider than SUGGESTION_SCAN_LIMIT, so a query never ranks
+        # more than that many keys
+        self.top: Dict[str, List[int]] = {}
+        pending = [(0, len(self.keys), 1)]
+        while pending:
+            start, end, length = pending.pop()
+            while start < end:
+                prefix = self.keys[start][:length]
+                if len(prefix) < length:
+                    # Key shorter than the prefix: already covered by a shorter prefix
+                    start += 1
+                    continue
+                stop = bisect_left(self.keys, prefix + "\uffff", start, end)
+                if length <= precomputed_length or stop - start > SUGGESTION_SCAN_LIMIT:
+                    self.top[prefix] = self._rank(start, stop, limit)
+                    pending.append((start, stop, length + 1))
+                start = stop
+
+        self.build_seconds = time.perf_counter() - started
+        logger.info(
+            f"Built suggestion index: {len(self.displays)} phrases, {len(self.keys)} keys, "
+            f"{len(self.top)} precomputed prefixes in {self.build_seconds:.3f}s"
+        )
+
+    def _rank(self, start: int, end: int, limit: int) -> List[int]:
+        """Best phrases of a key range: most popular, then matched at the start, then shortest"""
+        best: Dict[int, int] = {}
+        for entry in range(start, end):
+            phrase_id = self.phrase_ids[entry]
+            position = self.positions[entry]
+            if best.get(phrase_id, position + 1) > position:
+                best[phrase_id] = position
+        popularity, displays = self.popularity, self.displays
+        return heapq.nsmallest(
+            limit, best,
+            key=lambda phrase_id: (
+                -popularity[phrase_id], best[phrase_id], len(displays[phrase_id]), displays[phrase_id]
+            )
+        )
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        """Top `limit` completions of `prefix` (normalized like the phrases)"""
+        prefix = " ".join(normalize_text(prefix).split())
+        if not prefix or limit <= 0:
+            return []
+        if limit <= self.limit and prefix in self.top:
+            phrase_ids = self.top[prefix][:limit]
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + "\uffff", start)
+            phrase_ids = self._rank(start, end, limit)
+        return [self.displays[phrase_id] for phrase_id in phrase_ids]
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the sorted keys, phrases and precomputed completions"""
+        return (sizeof_items(self.displays) + sizeof_items(self.keys) + sizeof_items(self.top)
+                + sum(map(getsizeof, (self.phrase_ids, self.positions, self.popularity))))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size information"""
+        return {
+            "fields": list(self.fields),
+            "phrases": len(self.displays),
+            "keys": len(self.keys),
+            "precomputed_prefixes": len(self.top),
+            "build_seconds": round(self.build_seconds, 4),
+        }
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance (Damerau-Levenshtein with adjacent swaps), capped at max_distance + 1"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """
+    SymSpell-style correction dictionary over the catalog vocabulary.
+
+    Every word (and every query term) is reduced to its deletion
+    neighbourhood: the strings obtained by deleting up to `max_distance`
+    characters from its first `prefix_length` characters. Words sharing a
+    deletion with a query term are the only candidates; each is checked
+    with a real edit distance, so a lookup costs a few dict probes instead
+    of a pass over the vocabulary.
+    """
+
+    def __init__(
+        self,
+        store: "ProductStore",
+        fields: Sequence[str],
+        max_distance: int = SPELLING_MAX_DISTANCE,
+        prefix_length: int = SPELLING_PREFIX_LENGTH
+    ):
+        started = time.perf_counter()
+        self.fields = tuple(fields)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+
+        stop_words = store.analyzer.stop_words
+        counts: Counter = Counter()
+        for field in self.fields:
+            column = store.text_column(field)
+            for ordinal in store.all_ordinals():
+                text = column[ordinal]
+                counts.update(
+                    word for word in WORD.findall(text)
+                    if len(word) >= SPELLING_MIN_LENGTH and not word.isdigit() and word not in stop_words
+                )
+        self.counts: Dict[str, int] = dict(counts)
+
+        deletes: Dict[str, List[str]] = {}
+        for word in self.counts:
+            for variant in self._deletes(word):
+                deletes.setdefault(variant, []).append(word)
+        self.deletes = deletes
+
+        self.build_seconds = time.perf_counter() - started
+        logger.info(
+            f"Built spelling index: {len(self.counts)} words, {len(deletes)} deletions "
+            f"in {self.build_seconds:.3f}s"
+        )
+
+    def _deletes(self, word: str) -> Set[str]:
+        """Deletion neighbourhood of the word's prefix, the prefix included"""
+        level = {word[:self.prefix_length]}
+        variants = set(level)
+        for _ in range(self.max_distance):
+            level = {
+                candidate[:i] + candidate[i + 1:]
+                for candidate in level if len(candidate) > 1
+                for i in range(len(candidate))
+            }
+            variants |= level
+        return variants
+
+    def lookup(self, word: str) -> Optional[str]:
+        """Closest catalog word to `word` (most frequent among equals), None when nothing is close"""
+        if word in self.counts:
+            return word
+        # One typo allowed in short words, max_distance in longer ones
+        max_distance = 1 if len(word) <= 4 else self.max_distance
+
+        best: Optional[Tuple[int, int, str]] = None
+        seen: Set[str] = set()
+        for variant in self._deletes(word):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, max_distance)
+                if distance <= max_distance:
+                    key = (distance, -self.counts[candidate], candidate)
+                    if best is None or key < best:
+                        best = key
+        return best[2] if best else None
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the word counts and deletion dictionary"""
+        return sizeof_items(self.counts) + sizeof_items(self.deletes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size information"""
+        return {
+            "fields": list(self.fields),
+            "words": len(self.counts),
+            "deletions": len(self.deletes),
+            "build_seconds": round(self.build_seconds, 4),
+        }
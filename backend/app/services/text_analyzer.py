@@ -0,0 +1,89 @@
+"""Text analysis for search: tokenization, stop-words and light stemming (Québec French)"""
+
+import re
+from functools import lru_cache
+from sys import intern
+from typing import FrozenSet, Iterable, List, Optional
+
+from app.core.utils import normalize_text
+
+# Elided articles and pronouns: l'été, d'érable, qu'il, jusqu'à (after normalization)
+ELISION = re.compile(r"\b(?:l|d|j|m|n|s|t|c|qu|jusqu|lorsqu|puisqu|quoiqu)['’]")
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# Normalized (unaccented) French function words; words that tell products
+# apart (été, plus, sans, sous: "sans gluten", "sous-verre") are kept
+FRENCH_STOP_WORDS: FrozenSet[str] = frozenset("""
+    a au aux avec ce ces cet cette d dans de des du elle elles en et eux il ils
+    j je l la le les leur leurs lui m ma mais me mes moi mon n ne ni nos notre
+    nous on ou par pas pour qu que qui s sa se ses si son sur t ta te tes toi
+    ton tu un une vos votre vous y c ca est sont etre avoir tres comme chez
+    entre vers
+""".split())
+
+# Words ending in -s in the singular: their final s is not a plural mark
+INVARIANT_ENDINGS = ("is", "os", "us", "ss")
+
+# Stems memoized per analyzer: room for a catalog's vocabulary, while query
+# words (user input) cannot grow the memo without bound
+STEM_CACHE_SIZE = 65536
+
+
+class FrenchAnalyzer:
+    """
+    Analyzer shared by indexing and querying.
+
+    Text is normalized (lowercase, no accents), elisions are dropped,
+    tokens are runs of letters and digits, stop-words are removed and the
+    rest is lightly stemmed: plural (-s, -x, -aux) and feminine (-e, -ee)
+    endings are stripped, so "cadeaux" matches "cadeau" and "québécoises"
+    matches "québécois". Stems are memoized per analyzer, in a bounded
+    LRU cache (STEM_CACHE_SIZE).
+    """
+
+    def __init__(
+        self,
+        stop_words: Optional[Iterable[str]] = FRENCH_STOP_WORDS,
+        stemming: bool = True,
+        min_stem_length: int = 4,
+        cache_size: int = STEM_CACHE_SIZE
+    ):
+        self.stop_words = frozenset(stop_words or ())
+        self.stemming = stemming
+        self.min_stem_length = min_stem_length
+        self._stems = lru_cache(maxsize=cache_size)(self._stem)
+
+    def stem(self, token: str) -> str:
+        """Light French stem of a normalized token"""
+        return self._stems(token)
+
+    def _stem(self, token: str) -> str:
+        stem = token
+        if self.stemming and len(token) >= self.min_stem_length and not token.isdigit():
+            # Plural
+            if stem.endswith("eaux"):
+                stem = stem[:-1]
+            elif stem.endswith("aux") and len(stem) > 4:
+                stem = stem[:-2] + "l"
+            elif stem.endswith("x"):
+                stem = stem[:-1]
+            elif stem.endswith("s") and not stem.endswith(INVARIANT_ENDINGS):
+                stem = stem[:-1]
+            # Feminine
+            if stem.endswith("ee"):
+                stem = stem[:-2]
+            elif stem.endswith("e") and len(stem) >= self.min_stem_length:
+                stem = stem[:-1]
+
+        return intern(stem)
+
+    def analyze(self, text: Optional[str]) -> List[str]:
+        """Tokens of `text`, in order (duplicates kept, for term frequencies)"""
+        if not text:
+            return []
+        text = ELISION.sub(" ", normalize_text(str(text)))
+        stop_words, stem = self.stop_words, self._stems
+        return [stem(token) for token in TOKEN.findall(text) if token not in stop_words]
+
+
+DEFAULT_ANALYZER = FrenchAnalyzer()
@@ -60,6 +60,8 @@ if 'recommendations' not in st.session_state:
     st.session_state.recommendations = None
 if 'products' not in st.session_state:
     st.session_state.products = None
+if 'products_etag' not in st.session_state:
+    st.session_state.products_etag = None
 
 # En-tÃªte principal
 st.title("ðŸŽ TrouveUnCadeau.xyz")
@@ -202,13 +204,23 @@ st.markdown("---")
 if st.checkbox("ðŸ“„ Afficher tous les produits disponibles"):
     with st.spinner("ðŸ“… Chargement des produits..."):
         try:
+            # Requete conditionnelle: 304 si le catalogue n'a pas change
+            headers = {}
+            if st.session_state.products is not None and st.session_state.products_etag:
+                headers["If-None-Match"] = st.session_state.products_etag
             response = requests.get(
                 f"{BACKEND_URL}/api/products",
                 params={"limit": 100},
+                headers=headers,
                 timeout=10
             )
-            response.raise_for_status()
-            data = response.json()
+            if response.status_code == 304:
+                data = st.session_state.products
+            else:
+                response.raise_for_status()
+                data = response.json()
+                st.session_state.products = data
+                st.session_state.products_etag = response.headers.get("ETag")
             
             if data.get('products'):
                 st.info(f"ðŸ“‘ {data['count']} produits disponibles dans notre base de donnÃ©es")
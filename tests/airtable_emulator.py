@@ -0,0 +1,271 @@
+"""Émulateur local de l'API Airtable pour les tests et benchmarks hors ligne
+
+Implémente le sous-ensemble de l'API "list records" utilisé par AirtableService:
+pagination par `offset`, `pageSize`, `fields[]`, les formes de `filterByFormula`
+que nous envoyons (IS_AFTER(LAST_MODIFIED_TIME(), ...) et
+OR(RECORD_ID()='...', ...)), la
+limite de 5 requêtes/seconde (réponse 429) et les pannes (attribut `outage`).
+
+Deux façons de l'utiliser:
+- en transport httpx, dans le même processus:
+    AirtableService(..., base_url=emulator.table_url, transport=emulator)
+- en serveur ASGI, pour des tests de charge contre le backend complet:
+    AIRTABLE_SYNTHETIC_ROWS=50000 uvicorn tests.airtable_emulator:app --port 8900
+    AIRTABLE_BASE_URL=http://localhost:8900/v0/appEmu/tblEmu uvicorn backend.app.main:app
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import httpx
+
+DEFAULT_BASE_ID = "appEmu"
+DEFAULT_TABLE_ID = "tblEmu"
+
+MAX_PAGE_SIZE = 100
+
+MODIFIED_FORMULA = re.compile(r"^IS_AFTER\(LAST_MODIFIED_TIME\(\),\s*'(?P<since>[^']+)'\)$")
+RECORD_IDS_FORMULA = re.compile(r"^OR\((?P<terms>RECORD_ID\(\)='[^']+'(,\s*RECORD_ID\(\)='[^']+')*)\)$")
+RECORD_ID_TERM = re.compile(r"RECORD_ID\(\)='(?P<id>[^']+)'")
+
+CATEGORIES = [
+    "Tech", "Cuisine", "Sport", "Lecture", "Musique", "Jeux",
+    "Beauté", "Maison", "Voyage", "Artisanat québécois",
+]
+ADJECTIVES = [
+    "artisanal", "bluetooth", "québécois", "personnalisé", "écologique",
+    "gourmand", "portable", "vintage", "lumineux", "confortable",
+]
+NOUNS = [
+    "casque", "chocolat", "livre", "tasse", "sac", "jeu", "bougie",
+    "montre", "carnet", "foulard", "haut-parleur", "panier",
+]
+TAGS = ["noël", "anniversaire", "fête des mères", "enfant", "adulte", "local", "luxe"]
+
+
+def generate_catalog(rows: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Générer un catalogue synthétique de `rows` produits (déterministe)"""
+    rng = random.Random(seed)
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    records = []
+    for index in range(rows):
+        noun, adjective = rng.choice(NOUNS), rng.choice(ADJECTIVES)
+        records.append({
+            "id": f"rec{index:014d}",
+            "createdTime": (created + timedelta(seconds=index)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "fields": {
+                "Name": f"{noun.capitalize()} {adjective} {index}",
+                "ASIN": f"B0{index:08d}",
+                "Price": f"{rng.uniform(5, 300):.2f}",
+                "Category": rng.choice(CATEGORIES),
+                "Tags": ", ".join(rng.sample(TAGS, 2)),
+                "Description": " ".join(rng.choice(NOUNS + ADJECTIVES) for _ in range(40)),
+                "Image": [{"url": f"https://images.example.com/{index}.jpg"}],
+            },
+        })
+    return records
+
+
+class AirtableEmulator(httpx.AsyncBaseTransport):
+    """Faux Airtable en mémoire (transport httpx et application ASGI)"""
+
+    def __init__(
+        self,
+        records: Optional[List[Dict[str, Any]]] = None,
+        base_id: str = DEFAULT_BASE_ID,
+        table_id: str = DEFAULT_TABLE_ID,
+        rate_limit: Optional[float] = 5.0,
+        retry_after: Optional[float] = None,
+        latency: float = 0.0,
+    ):
+        """
+        Args:
+            records: Enregistrements initiaux (voir generate_catalog)
+            rate_limit: Requêtes/seconde tolérées avant 429 (None = illimité)
+            retry_after: Valeur de l'en-tête Retry-After sur 429 (Airtable n'en envoie pas)
+            latency: Délai simulé par requête, en secondes
+        """
+        self.base_id = base_id
+        self.table_id = table_id
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.latency = latency
+        # Statut HTTP renvoyé à toutes les requêtes pendant une panne simulée (None = en service)
+        self.outage: Optional[int] = None
+
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.modified: Dict[str, datetime] = {}
+        self.version = 0
+        self._matches: Dict[Tuple[str, int], List[str]] = {}
+        self._recent = deque()
+
+        self.requests = 0
+        self.throttled = 0
+        self.records_sent = 0
+
+        epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for record in records or []:
+            self.records[record["id"]] = record
+            self.modified[record["id"]] = epoch
+
+    @classmethod
+    def synthetic(cls, rows: int = 1000, seed: int = 42, **kwargs) -> "AirtableEmulator":
+        """Émulateur pré-rempli avec un catalogue synthétique"""
+        return cls(generate_catalog(rows, seed), **kwargs)
+
+    @property
+    def table_url(self) -> str:
+        """URL à passer en `base_url` à AirtableService"""
+        return f"https://airtable.emulator/v0/{self.base_id}/{self.table_id}"
+
+    # ============ MUTATIONS ============
+
+    def upsert(self, record_id: str, fields: Dict[str, Any]):
+        """Créer ou modifier un enregistrement (met à jour LAST_MODIFIED_TIME)"""
+        record = self.records.get(record_id)
+        if record is None:
+            record = {
+                "id": record_id,
+                "createdTime": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "fields": {},
+            }
+            self.records[record_id] = record
+        record["fields"].update(fields)
+        self.modified[record_id] = datetime.now(timezone.utc)
+        self.version += 1
+
+    def delete(self, record_id: str):
+        """Supprimer un enregistrement"""
+        self.records.pop(record_id, None)
+        self.modified.pop(record_id, None)
+        self.version += 1
+
+    # ============ API ============
+
+    def _throttle(self) -> bool:
+        """Fenêtre glissante d'une seconde, comme la limite par base d'Airtable"""
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    def _matching_ids(self, formula: str) -> List[str]:
+        """Ids correspondant à la formule, mémorisés par version des données"""
+        key = (formula, self.version)
+        if key in self._matches:
+            return self._matches[key]
+
+        if not formula:
+            ids = list(self.records)
+        elif MODIFIED_FORMULA.match(formula):
+            since = datetime.fromisoformat(
+                MODIFIED_FORMULA.match(formula).group("since").replace("Z", "+00:00")
+            )
+            ids = [record_id for record_id in self.records if self.modified[record_id] > since]
+        elif RECORD_IDS_FORMULA.match(formula):
+            wanted = {match.group("id") for match in RECORD_ID_TERM.finditer(formula)}
+            ids = [record_id for record_id in self.records if record_id in wanted]
+        else:
+            raise ValueError(formula)
+
+        if len(self._matches) > 32:
+            self._matches.clear()
+        self._matches[key] = ids
+        return ids
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        """Traiter une requête, retourne (status, en-têtes, corps JSON)"""
+        self.requests += 1
+
+        if path.rstrip("/") != f"/v0/{self.base_id}/{self.table_id}":
+            return 404, {}, {"error": "NOT_FOUND"}
+        if method != "GET":
+            return 405, {}, {"error": "METHOD_NOT_ALLOWED"}
+        if self.outage is not None:
+            return self.outage, {}, {"error": "SERVICE_UNAVAILABLE"}
+
+        if self._throttle():
+            self.throttled += 1
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            return 429, headers, {"errors": [{"error": "RATE_LIMIT_REACHED"}]}
+
+        formula = query.get("filterByFormula", [""])[0]
+        try:
+            ids = self._matching_ids(formula)
+        except ValueError:
+            return 422, {}, {"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": formula}}
+
+        try:
+            page_size = min(int(query.get("pageSize", [MAX_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+            start = int(query.get("offset", ["0"])[0].split("/")[-1])
+        except ValueError:
+            return 422, {}, {"error": {"type": "LIST_RECORDS_ITERATOR_NOT_AVAILABLE"}}
+
+        fields = query.get("fields[]", []) + query.get("fields", [])
+        page = []
+        for record_id in ids[start:start + page_size]:
+            record = self.records[record_id]
+            record_fields = record["fields"]
+            if fields:
+                record_fields = {k: v for k, v in record_fields.items() if k in fields}
+            page.append({"id": record_id, "createdTime": record["createdTime"], "fields": record_fields})
+        self.records_sent += len(page)
+
+        body: Dict[str, Any] = {"records": page}
+        if start + page_size < len(ids):
+            body["offset"] = f"itr{self.version}/{start + page_size}"
+        return 200, {}, body
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Point d'entrée transport httpx"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = parse_qs(request.url.query.decode(), keep_blank_values=True)
+        status, headers, body = self.handle(request.method, request.url.path, query)
+        return httpx.Response(status, headers=headers, json=body, request=request)
+
+    async def __call__(self, scope, receive, send):
+        """Point d'entrée ASGI (uvicorn)"""
+        if scope["type"] != "http":
+            return
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = parse_qs(scope.get("query_string", b"").decode(), keep_blank_values=True)
+        status, headers, body = self.handle(scope["method"], scope["path"], query)
+
+        payload = json.dumps(body).encode()
+        raw_headers = [(b"content-type", b"application/json")]
+        raw_headers += [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Compteurs de requêtes"""
+        return {
+            "records": len(self.records),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "records_sent": self.records_sent,
+        }
+
+
+# Application ASGI: `uvicorn tests.airtable_emulator:app`
+app = AirtableEmulator.synthetic(
+    rows=int(os.getenv("AIRTABLE_SYNTHETIC_ROWS", 1000)),
+    rate_limit=float(os.getenv("AIRTABLE_EMULATOR_RATE_LIMIT", 5)) or None,
+    latency=float(os.getenv("AIRTABLE_EMULATOR_LATENCY", 0)),
+)
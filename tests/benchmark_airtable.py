@@ -0,0 +1,83 @@
+"""Benchmark hors ligne d'AirtableService contre l'émulateur local
+
+Usage (depuis la racine du dépôt):
+    python tests/benchmark_airtable.py --rows 20000 --latency 0.05
+
+Mesure la synchronisation complète, une synchronisation delta et la
+lecture du catalogue local, sans aucun appel au vrai Airtable.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.airtable_service import AirtableService  # noqa: E402
+from app.services.catalog_store import CatalogStore  # noqa: E402
+from airtable_emulator import AirtableEmulator  # noqa: E402
+
+
+async def run(rows: int, latency: float, rate_limit: float, changes: int):
+    emulator = AirtableEmulator.synthetic(rows=rows, rate_limit=None, latency=latency)
+    with tempfile.TemporaryDirectory() as directory:
+        service = AirtableService(
+            api_key="bench",
+            base_id=emulator.base_id,
+            table_id=emulator.table_id,
+            base_url=emulator.table_url,
+            transport=emulator,
+            http2=False,
+            rate_limit=rate_limit,
+            burst=int(rate_limit),
+            catalog=CatalogStore(os.path.join(directory, "catalog.sqlite3")),
+        )
+
+        start = time.perf_counter()
+        await service.sync_catalog()
+        full_sync = time.perf_counter() - start
+        full_requests = emulator.requests
+
+        for index in range(changes):
+            emulator.upsert(f"rec{index:014d}", {"Price": "1.00"})
+        start = time.perf_counter()
+        await service.sync_catalog()
+        delta_sync = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            await service.get_all_products()
+        local_read = (time.perf_counter() - start) / 1000
+
+        service.catalog.close()
+        reload_store = CatalogStore(service.catalog.path)
+        start = time.perf_counter()
+        reload_store.load()
+        snapshot_load = time.perf_counter() - start
+        reload_store.close()
+
+        await service.close()
+
+    print(f"rows={rows} latency={latency * 1000:.0f}ms rate={rate_limit}/s")
+    print(f"  full sync      {full_sync * 1000:10.1f} ms  ({full_requests} requests)")
+    print(f"  delta sync     {delta_sync * 1000:10.1f} ms  ({changes} changed records)")
+    print(f"  local read     {local_read * 1e6:10.1f} µs  (get_all_products)")
+    print(f"  snapshot load  {snapshot_load * 1000:10.1f} ms  (restart)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.0, help="latence simulée par requête (s)")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="requêtes/s côté client")
+    parser.add_argument("--changes", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.latency, args.rate_limit, args.changes))
+
+
+if __name__ == "__main__":
+    main()
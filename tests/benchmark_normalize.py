@@ -0,0 +1,82 @@
+"""Microbenchmark de normalize_text: version table de traduction vs ancienne version
+
+Usage (depuis la racine du dépôt):
+    python tests/benchmark_normalize.py --rows 20000
+
+Compare l'ancienne implémentation (un str.replace par diacritique) à la
+version actuelle sur des noms, des descriptions et des termes courts
+répétés (catégories, mots de requête), et vérifie que les résultats
+concordent sur les lettres que l'ancienne version gérait.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.utils import normalize_text  # noqa: E402
+from airtable_emulator import generate_catalog, CATEGORIES  # noqa: E402
+
+
+def legacy_normalize_text(text: str) -> str:
+    """Ancienne implémentation (avant la table de traduction)"""
+    if not isinstance(text, str):
+        return ""
+
+    text = text.lower().strip()
+
+    diacritic_map = {
+        'à': 'a', 'â': 'a', 'ä': 'a',
+        'é': 'e', 'è': 'e', 'ê': 'e', 'ë': 'e',
+        'î': 'i', 'ï': 'i',
+        'ô': 'o', 'ö': 'o',
+        'ù': 'u', 'û': 'u', 'ü': 'u',
+        'ç': 'c',
+        'ñ': 'n'
+    }
+
+    for char, replacement in diacritic_map.items():
+        text = text.replace(char, replacement)
+
+    return text
+
+
+def measure(func, values, repeat: int) -> float:
+    """Durée moyenne par appel, en microsecondes"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            func(value)
+    return (time.perf_counter() - start) / (repeat * len(values)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = generate_catalog(args.rows)
+    workloads = {
+        "noms": [record["fields"]["Name"] for record in records],
+        "descriptions": [record["fields"]["Description"] for record in records],
+        "termes courts": (CATEGORIES + ["Noël", "fête des mères", "québécois", "cadeau"]) * (args.rows // 10),
+    }
+
+    for name, values in workloads.items():
+        mismatches = sum(1 for value in values if legacy_normalize_text(value) != normalize_text(value))
+        legacy = measure(legacy_normalize_text, values, args.repeat)
+        current = measure(normalize_text, values, args.repeat)
+        print(
+            f"{name:>14}: ancienne {legacy:6.2f} µs, table {current:6.2f} µs "
+            f"(x{legacy / current:.1f}), écarts {mismatches}"
+        )
+
+    print(f"Couverture: {normalize_text('Œuvre, cœur, Æsop, ÿ, À l’été, Ça')!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""Configuration pytest partagée
+
+Les modules du backend s'importent en `app.*` (comme dans le conteneur):
+on ajoute donc `backend/` au chemin d'import.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
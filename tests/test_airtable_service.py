@@ -0,0 +1,404 @@
+"""Tests pour AirtableService contre l'émulateur Airtable local
+
+Aucun appel réseau: le service est pointé vers tests/airtable_emulator.py.
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from app.core.cache import SingleFlight
+from app.core.rate_limiter import RequestPriority
+from app.services import bitmap
+from app.services.airtable_service import AirtableService
+from app.services.catalog_store import CatalogStore
+from airtable_emulator import AirtableEmulator
+
+
+def make_service(emulator: AirtableEmulator, **kwargs) -> AirtableService:
+    """Service branché sur l'émulateur, sans throttling côté client"""
+    options = {"rate_limit": 1000.0, "burst": 1000, "backoff_base": 0.01}
+    options.update(kwargs)
+    return AirtableService(
+        api_key="test",
+        base_id=emulator.base_id,
+        table_id=emulator.table_id,
+        base_url=emulator.table_url,
+        transport=emulator,
+        http2=False,
+        **options
+    )
+
+
+class RecordingEmulator(AirtableEmulator):
+    """Émulateur qui note chaque requête reçue: (instant, formule, statut)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    def handle(self, method, path, query):
+        status, headers, body = super().handle(method, path, query)
+        self.log.append((time.monotonic(), query.get("filterByFormula", [""])[0], status))
+        return status, headers, body
+
+
+async def wait_until(predicate, timeout: float = 2.0):
+    """Attendre qu'une condition devienne vraie (tâches de fond)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition jamais atteinte"
+        await asyncio.sleep(0.005)
+
+
+class TestPagination:
+    """Tests pour la pagination par curseur"""
+
+    @pytest.mark.asyncio
+    async def test_get_all_products_follows_offset(self):
+        """Test que tout le catalogue est récupéré, au-delà de 100 lignes"""
+        emulator = AirtableEmulator.synthetic(rows=250, rate_limit=None)
+        service = make_service(emulator)
+
+        products = await service.get_all_products()
+
+        assert len(products) == 250
+        assert emulator.requests == 3
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_fields_projection(self):
+        """Test que seules les colonnes demandées sont téléchargées"""
+        emulator = AirtableEmulator.synthetic(rows=10, rate_limit=None)
+        service = make_service(emulator)
+
+        products = [p async for p in service.iter_products(fields=["Category"])]
+
+        assert all(set(p) == {"id", "Category"} for p in products)
+        await service.close()
+
+
+class TestCatalogSync:
+    """Tests pour la synchronisation incrémentale du catalogue"""
+
+    @pytest.mark.asyncio
+    async def test_delta_sync_and_deletions(self, tmp_path):
+        """Test que le delta ne ramène que les modifications et réconcilie les suppressions"""
+        emulator = AirtableEmulator.synthetic(rows=150, rate_limit=None)
+        service = make_service(
+            emulator,
+            catalog=CatalogStore(str(tmp_path / "catalog.sqlite3")),
+            reconcile_interval=0
+        )
+        await service.sync_catalog()
+
+        emulator.upsert("rec00000000000001", {"Price": "1.00"})
+        emulator.upsert("recNEW", {"Name": "Nouveau", "Price": "9.99"})
+        emulator.delete("rec00000000000002")
+        result = await service.sync_catalog()
+
+        assert result == {"changed": 2, "deleted": 1, "total": 150}
+        assert service.catalog.get("rec00000000000001")["Price"] == "1.00"
+        assert service.catalog.get("rec00000000000002") is None
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_restart_from_snapshot(self, tmp_path):
+        """Test que le catalogue est servi depuis le snapshot sans appeler Airtable"""
+        path = str(tmp_path / "catalog.sqlite3")
+        emulator = AirtableEmulator.synthetic(rows=50, rate_limit=None)
+        service = make_service(emulator, catalog=CatalogStore(path))
+        await service.sync_catalog()
+        await service.close()
+        service.catalog.close()
+
+        offline = AirtableEmulator(rate_limit=None)
+        restarted = make_service(offline, catalog=CatalogStore(path))
+
+        assert restarted.load_catalog() == 50
+        assert len(await restarted.get_all_products()) == 50
+        assert offline.requests == 0
+        assert restarted.catalog.content_hash == service.catalog.content_hash
+        await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_content_hash_follows_content(self):
+        """Test que le hash du contenu ne change que si les données changent"""
+        emulator = AirtableEmulator.synthetic(rows=20, rate_limit=None)
+        service = make_service(emulator)
+        await service.sync_catalog()
+        initial = service.catalog.content_hash
+
+        await service.sync_catalog(full=True)
+        assert service.catalog.content_hash == initial
+
+        price = emulator.records["rec00000000000003"]["fields"]["Price"]
+        emulator.upsert("rec00000000000003", {"Price": "12.00"})
+        await service.sync_catalog()
+        assert service.catalog.content_hash != initial
+
+        emulator.upsert("rec00000000000003", {"Price": price})
+        await service.sync_catalog()
+        assert service.catalog.content_hash == initial
+        assert (await service.get_product_store()).content_hash == initial
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_default_projection_includes_tags(self):
+        """Test que les étiquettes sont synchronisées par défaut (filtres et facettes par tag)"""
+        emulator = AirtableEmulator.synthetic(rows=40, rate_limit=None)
+        service = make_service(emulator)
+        await service.sync_catalog()
+
+        store = await service.get_product_store()
+        tags = dict(store.tag_facets())
+        assert "noël" in tags
+        assert bitmap.count(store.tag_bitmap(["Noël"])) == bitmap.count(tags["noël"]) > 0
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_product_store_follows_deltas(self):
+        """Test qu'un petit delta est appliqué au magasin précédent plutôt que de le reconstruire"""
+        emulator = AirtableEmulator.synthetic(rows=30, rate_limit=None)
+        service = make_service(emulator, reconcile_interval=0)
+        await service.sync_catalog()
+        initial = await service.get_product_store()
+
+        emulator.upsert("rec00000000000001", {"Price": "1.00"})
+        emulator.upsert("recNEW", {"Name": "Nouveau", "Price": "9.99"})
+        emulator.delete("rec00000000000002")
+        await service.sync_catalog()
+
+        assert service.catalog.changes_since(initial.version) == (
+            ["rec00000000000001", "recNEW"], ["rec00000000000002"]
+        )
+        store = await service.get_product_store()
+        assert store.tombstones == 2 and store.live_count == 30
+        assert store.content_hash == service.catalog.content_hash
+        assert sorted(store.ids[ordinal] for ordinal in store.all_ordinals()) == sorted(service.catalog.ids())
+        assert [store.ids[ordinal] for ordinal in store.price_between(max_value=2)] == ["rec00000000000001"]
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_product_store_reads_one_generation(self):
+        """Test qu'une synchro publiée pendant la construction ne mélange pas deux versions"""
+        emulator = AirtableEmulator.synthetic(rows=10, rate_limit=None)
+        service = make_service(emulator)
+        await service.sync_catalog()
+        get_all_products = service.get_all_products
+
+        async def get_then_publish(*args, **kwargs):
+            products = await get_all_products(*args, **kwargs)
+            # Une synchro (dans son thread) publie la génération suivante
+            service.catalog.apply_delta([{"id": "recNEW", "Name": "Nouveau", "Price": 5.0}])
+            return products
+
+        service.get_all_products = get_then_publish
+        store = await service.get_product_store()
+        assert store.version == service.catalog.version
+        assert store.content_hash == service.catalog.content_hash
+        assert "recNEW" in store.ids
+        await service.close()
+
+
+class TestChangeNotifications:
+    """Tests pour les notifications de modification (webhook n8n)"""
+
+    @pytest.mark.asyncio
+    async def test_apply_changes_fetches_only_listed_records(self):
+        """Test qu'une notification ne relit que les enregistrements indiqués"""
+        emulator = AirtableEmulator.synthetic(rows=300, rate_limit=None)
+        service = make_service(emulator)
+        await service.sync_catalog()
+        sent = emulator.records_sent
+
+        emulator.upsert("rec00000000000007", {"Price": "1.00"})
+        emulator.delete("rec00000000000008")
+        result = await service.apply_changes(["rec00000000000007", "rec00000000000008"])
+
+        assert result == {"changed": 1, "deleted": 1, "total": 299}
+        assert emulator.records_sent - sent == 1
+        assert service.catalog.get("rec00000000000007")["Price"] == "1.00"
+        assert service.catalog.get("rec00000000000008") is None
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_apply_changes_rejects_invalid_ids(self):
+        """Test que les ids invalides ne sont jamais insérés dans une formule"""
+        service = make_service(AirtableEmulator(rate_limit=None))
+        with pytest.raises(ValueError):
+            await service.apply_changes(["rec1') , TRUE()"])
+        await service.close()
+
+
+class TestSingleFlight:
+    """Tests pour la fusion des appels concurrents vers Airtable"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_cold_start_makes_one_pass(self):
+        """Test que N lectures concurrentes à froid ne parcourent Airtable qu'une fois"""
+        emulator = AirtableEmulator.synthetic(rows=250, rate_limit=None, latency=0.01)
+        service = make_service(emulator)
+
+        results = await asyncio.gather(*[service.get_all_products() for _ in range(10)])
+
+        assert all(len(products) == 250 for products in results)
+        assert emulator.requests == 3
+        stats = service.get_coalescing_stats()
+        assert stats["executions"] == 1 and stats["coalesced"] == 9
+        assert stats["in_flight"] == []
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_refreshes_make_one_pass(self):
+        """Test que des rafraîchissements concurrents partagent la même synchronisation"""
+        emulator = AirtableEmulator.synthetic(rows=250, rate_limit=None, latency=0.01)
+        service = make_service(emulator)
+
+        results = await asyncio.gather(*[service.refresh_catalog() for _ in range(5)])
+
+        assert results == [True] * 5
+        assert emulator.requests == 3
+        assert service.get_coalescing_stats()["in_flight"] == []
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_error_reaches_every_waiter(self):
+        """Test que l'exception est remise à chaque appelant puis que la clé est libérée"""
+        flights = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("Airtable indisponible")
+
+        results = await asyncio.gather(
+            *[flights.do("catalog", failing) for _ in range(5)], return_exceptions=True
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert flights.executions == 1 and flights.coalesced == 4
+        assert flights.get("catalog") is None
+
+        with pytest.raises(RuntimeError):
+            await flights.do("catalog", failing)
+        assert flights.executions == 2
+
+
+class TestRefresher:
+    """Tests pour le rafraîchissement en arrière-plan et la dernière version valide"""
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_last_known_good(self):
+        """Test qu'un rafraîchissement en échec garde le catalogue précédent et le marque périmé"""
+        emulator = AirtableEmulator.synthetic(rows=120, rate_limit=None)
+        service = make_service(emulator, max_retries=0, sync_interval=0)
+        assert await service.refresh_catalog()
+        version = service.catalog.version
+
+        emulator.upsert("rec00000000000001", {"Price": "1.00"})
+        emulator.outage = 503
+
+        assert not await service.refresh_catalog()
+        status = service.get_catalog_status()
+        assert status["stale"] and status["consecutive_failures"] == 1
+        assert "503" in status["last_error"]
+
+        # Les lectures ne relancent pas de synchro avant refresh_retry_interval
+        requests = emulator.requests
+        products = await service.get_all_products()
+        assert len(products) == 120
+        assert not service.get_catalog_status()["refreshing"]
+        assert emulator.requests == requests
+        assert service.catalog.version == version
+        assert service.catalog.get("rec00000000000001")["Price"] != "1.00"
+
+        service.refresh_retry_interval = 0
+        await service.get_all_products()
+        assert service.get_catalog_status()["refreshing"]
+        await service.stop_refresher()
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_refresher_recovers_after_outage(self):
+        """Test que le rafraîchisseur réessaie pendant la panne puis reprend le catalogue"""
+        emulator = AirtableEmulator.synthetic(rows=50, rate_limit=None)
+        emulator.outage = 503
+        service = make_service(emulator, max_retries=0, refresh_retry_interval=0.01)
+
+        service.start_refresher()
+        await wait_until(lambda: service.refresh_failures >= 2)
+        assert len(service.catalog) == 0
+
+        emulator.outage = None
+        await wait_until(lambda: service.last_refresh_error is None)
+        status = service.get_catalog_status()
+        assert status["products"] == 50
+        assert status["consecutive_failures"] == 0 and not status["stale"]
+        await service.stop_refresher()
+        await service.close()
+
+
+class TestThrottling:
+    """Tests pour la gestion des 429"""
+
+    @pytest.mark.asyncio
+    async def test_retries_after_rate_limit(self):
+        """Test que les lectures sont relancées après un 429"""
+        emulator = AirtableEmulator.synthetic(rows=500, rate_limit=2, retry_after=0.5)
+        service = make_service(emulator)
+
+        products = await service.get_all_products()
+
+        assert len(products) == 500
+        assert emulator.throttled > 0
+        assert service.get_scheduler_stats()["throttled"] == emulator.throttled
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_interactive_requests_go_first(self):
+        """Test que les requêtes interactives en attente passent avant les pages de fond"""
+        emulator = RecordingEmulator.synthetic(rows=30, rate_limit=None)
+        service = make_service(emulator, rate_limit=100.0, burst=1)
+        service.scheduler.pause(0.3)
+
+        async def background_read():
+            return [p async for p in service.iter_products(priority=RequestPriority.BACKGROUND)]
+
+        background = [asyncio.create_task(background_read()) for _ in range(3)]
+        await wait_until(lambda: service.get_scheduler_stats()["queue_depth"] == 3)
+        interactive = [
+            asyncio.create_task(service.apply_changes([f"rec0000000000000{index}"]))
+            for index in (1, 2)
+        ]
+        await wait_until(lambda: service.get_scheduler_stats()["queue_depth"] == 5)
+        await asyncio.gather(*background, *interactive)
+
+        formulas = [formula for _, formula, _ in emulator.log]
+        assert [formula.startswith("OR(RECORD_ID()") for formula in formulas] == [True] * 2 + [False] * 3
+        stats = service.get_scheduler_stats()["priorities"]
+        assert stats["interactive"]["dispatched"] == 2 and stats["background"]["dispatched"] == 3
+        await service.close()
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_every_caller(self):
+        """Test qu'un 429 avec Retry-After suspend toute la file, pas seulement l'appel refusé"""
+        emulator = RecordingEmulator.synthetic(rows=250, rate_limit=2, retry_after=0.3)
+        service = make_service(emulator)
+
+        sync = asyncio.create_task(service.sync_catalog(full=True))
+        await wait_until(lambda: emulator.throttled >= 1)
+        throttled_at = next(at for at, _, status in emulator.log if status == 429)
+        await service.apply_changes(["rec00000000000001"])
+        await sync
+
+        sent_at = next(at for at, formula, _ in emulator.log if formula.startswith("OR(RECORD_ID()"))
+        assert sent_at - throttled_at >= 0.25
+        assert service.get_scheduler_stats()["throttled"] == emulator.throttled
+        assert len(service.catalog) == 250
+        await service.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,307 @@
+"""Tests pour ProductStore et SearchEngine
+
+Tests unitaires, sans Airtable ni serveur.
+"""
+
+import math
+
+import pytest
+
+from app.core.utils import normalize_text
+from app.services import bitmap
+from app.services.product_store import ProductStore, parse_price
+from app.services.search_engine import SearchEngine
+from app.services.text_analyzer import FrenchAnalyzer
+
+PRODUCTS = [
+    {"id": "rec1", "Name": "Casque Bluetooth", "Price": "$79.99", "Category": "Tech", "Tags": "Adulte, Noël",
+     "Description": "Casque sans fil avec réduction de bruit"},
+    {"id": "rec2", "Name": "Chocolat artisanal québécois", "Price": "24,50", "Category": "Cuisine",
+     "Description": "Boîte de chocolats fins de Québec"},
+    {"id": "rec3", "Name": "Livre de recettes", "Price": 35, "Category": "cuisine", "Tags": ["Noël"],
+     "Description": "Recettes traditionnelles"},
+    {"id": "rec4", "Name": "Carte cadeau", "Price": "", "Category": "Tech"},
+]
+
+
+@pytest.fixture
+def store():
+    return ProductStore(PRODUCTS, version=1)
+
+
+class TestNormalizeText:
+    """Tests pour la normalisation du texte"""
+
+    def test_french_letters(self):
+        """Test lettres françaises et québécoises, ligatures comprises"""
+        assert normalize_text("  Œuvre d'ÉTÉ à Noël ") == "oeuvre d'ete a noel"
+        assert normalize_text("Cœur, Æther, L'Haÿ-les-Roses, Ça") == "coeur, aether, l'hay-les-roses, ca"
+        assert normalize_text("e\u0301te\u0301") == "ete"
+        assert normalize_text("Casque Bluetooth") == "casque bluetooth"
+        assert normalize_text(None) == ""
+
+
+class TestFrenchAnalyzer:
+    """Tests pour l'analyseur français"""
+
+    def test_stop_words_elisions_and_stems(self):
+        """Test mots vides, élisions et racinisation légère"""
+        analyzer = FrenchAnalyzer()
+        assert analyzer.analyze("Des cadeaux pour l'été, d'érable!") == ["cadeau", "ete", "erabl"]
+        assert analyzer.analyze("Biscuits sans gluten") == ["biscuit", "san", "gluten"]
+        assert analyzer.analyze("cadeau d'érable") == ["cadeau", "erabl"]
+        assert analyzer.analyze("québécoises") == analyzer.analyze("Québécois")
+        assert analyzer.analyze("journaux") == analyzer.analyze("journal")
+        assert analyzer.analyze("jeux") == ["jeu"]
+        assert FrenchAnalyzer(stemming=False).analyze("Les livres") == ["livres"]
+
+    def test_stem_cache_is_bounded(self):
+        """Test que des mots de requête tous différents ne font pas grossir le cache sans limite"""
+        analyzer = FrenchAnalyzer(cache_size=100)
+        for number in range(1000):
+            analyzer.analyze(f"cadeaux{number}x")
+        assert analyzer._stems.cache_info().currsize == 100
+        assert analyzer.analyze("cadeaux") == ["cadeau"]
+
+    def test_keyword_search_matches_plurals(self, store):
+        """Test qu'une requête au pluriel trouve le singulier, sans compter les mots vides"""
+        results = SearchEngine().keyword_search("des casques pour la musique", store, ["name"])
+        assert [ordinal for ordinal, _ in results] == [0]
+
+
+class TestProductStore:
+    """Tests pour le stockage typé du catalogue"""
+
+    def test_parse_price(self):
+        """Test analyse des différents formats de prix"""
+        assert parse_price("$79.99") == 79.99
+        assert parse_price("24,50") == 24.5
+        assert parse_price(35) == 35.0
+        assert math.isnan(parse_price(""))
+        assert math.isnan(parse_price(None))
+
+    def test_columns(self, store):
+        """Test colonnes typées et catégories internées"""
+        assert len(store) == 4
+        assert store.prices[0] == 79.99
+        assert store.categories[store.category_codes[1]] == "Cuisine"
+        assert store.categories[store.category_codes[3]] == "Tech"
+        assert store.category_codes[0] == store.category_codes[3]
+
+    def test_category_index(self, store):
+        """Test index des catégories (casse et accents ignorés) et liste triée avec compteurs"""
+        assert list(store.category_postings("CUISINE")) == [1, 2]
+        assert list(store.category_postings("Inconnue")) == []
+        assert store.in_categories(["tech", "cuisine"]) == [0, 1, 2, 3]
+        assert store.category_counts == [("Cuisine", 2), ("Tech", 2)]
+
+    def test_price_between(self, store):
+        """Test filtre de prix par index trié (les prix inconnus sont exclus)"""
+        assert store.price_between(max_value=40) == [1, 2]
+        assert store.price_between(30, 100) == [2, 0]
+        assert store.price_between(30, 100, ordinals=[0, 1, 2]) == [0, 2]
+        assert list(store.price_range(20, 30)) == [1]
+
+    def test_filter_bitmaps(self, store):
+        """Test filtres en bitmaps: mêmes produits que les index triés"""
+        assert bitmap.to_ordinals(store.price_bitmap(max_value=40)) == sorted(store.price_between(max_value=40))
+        assert bitmap.to_ordinals(store.price_bitmap(30, 100)) == [0, 2]
+        assert store.price_bitmap(200) == bitmap.EMPTY
+        assert bitmap.to_ordinals(store.category_bitmap(["CUISINE", "Inconnue"])) == [1, 2]
+        assert bitmap.to_ordinals(store.tag_bitmap(["noel"])) == [0, 2]
+        assert bitmap.count(store.all_bitmap()) == 4
+        assert bitmap.intersect([store.tag_bitmap(["noel"]), store.category_bitmap(["tech"])]) == 1
+
+    def test_apply_changes(self, store):
+        """Test delta: modification, suppression et ajout sans reconstruire le magasin"""
+        engine = SearchEngine()
+        assert [store.ids[o] for o, _ in engine.keyword_search("chocolat", store, ["name"])] == ["rec2"]
+        updated = store.apply_changes(
+            [dict(PRODUCTS[0], Price="19.99", Category="Cuisine"),
+             {"id": "rec5", "Name": "Tuque en laine", "Price": "30", "Category": "Mode"}],
+            ["rec2"],
+            version=2
+        )
+
+        assert updated.version == 2 and store.version == 1
+        assert updated.tombstones == 2 and updated.live_count == len(updated) == 4
+        assert [updated.ids[o] for o in updated.all_ordinals()] == ["rec3", "rec4", "rec1", "rec5"]
+        assert updated.category_counts == [("Cuisine", 2), ("Mode", 1), ("Tech", 1)]
+        assert [updated.ids[ordinal] for ordinal in updated.price_between(max_value=40)] == \
+            ["rec1", "rec5", "rec3"]
+        assert bitmap.to_ordinals(updated.all_bitmap()) == [2, 3, 4, 5]
+
+        assert [updated.ids[o] for o, _ in engine.keyword_search("casque", updated, ["name"])] == ["rec1"]
+        assert engine.keyword_search("chocolat", updated, ["name"]) == []
+        assert [updated.ids[o] for o, _ in engine.keyword_search("tuque", updated, ["name"])] == ["rec5"]
+        assert [store.ids[o] for o, _ in engine.keyword_search("chocolat", store, ["name"])] == ["rec2"]
+        index = updated.inverted_index(["name"], engine.field_boosts)
+        assert (index.size, index.width) == (4, 6)
+        assert store.inverted_index(["name"], engine.field_boosts).size == 4
+        assert [store.ids[o] for o in store.all_ordinals()] == ["rec1", "rec2", "rec3", "rec4"]
+
+        # Le magasin d'origine garde ses colonnes (il peut encore être indexé ailleurs)
+        assert len(store.ids) == len(store.token_column("name")) == 4
+
+        # Deuxième delta sur la même version: les colonnes du premier ne sont pas écrasées
+        other = store.apply_changes([{"id": "rec6", "Name": "Bougie", "Price": "12"}], version=2)
+        assert [other.ids[o] for o in other.all_ordinals()] == ["rec1", "rec2", "rec3", "rec4", "rec6"]
+        assert [updated.ids[o] for o, _ in engine.keyword_search("tuque", updated, ["name"])] == ["rec5"]
+        assert updated.ids[5] == "rec5" and other.ids[4] == "rec6"
+
+        compacted = updated.compacted()
+        assert compacted.tombstones == 0
+        assert [compacted.ids[o] for o in compacted.all_ordinals()] == ["rec3", "rec4", "rec1", "rec5"]
+        assert compacted.category_counts == updated.category_counts
+
+
+class TestSearchEngine:
+    """Tests pour la recherche sur le ProductStore"""
+
+    def test_keyword_search_ignores_accents(self, store):
+        """Test recherche par mots-clés insensible aux accents"""
+        results = SearchEngine().keyword_search("chocolat quebecois", store, ["name"])
+        assert results[0][0] == 1
+
+    def test_inverted_index(self, store):
+        """Test index inversé: un produit par posting, restreint par ordinals"""
+        index = store.inverted_index(["name", "description"])
+        assert list(index.posting(store.analyzer.stem("casque"))) == [0]
+        assert list(index.posting(store.analyzer.stem("recettes"))) == [2]
+        assert store.inverted_index(["Description", "Name"]) is index
+
+        results = SearchEngine().keyword_search("recettes chocolat", store, ["name", "description"])
+        assert sorted(ordinal for ordinal, _ in results) == [1, 2]
+        assert SearchEngine().keyword_search("chocolat", store, ["name"], ordinals=[0, 2]) == []
+
+    def test_bm25_ranking(self):
+        """Test classement BM25: un mot dans le nom l'emporte sur la description"""
+        store = ProductStore([
+            {"id": "a", "Name": "Panier gourmand", "Description": "Bougie parfumée et thé"},
+            {"id": "b", "Name": "Bougie artisanale", "Description": "Cire de soya"},
+            {"id": "c", "Name": "Coffret", "Description": "Bougie, bougie et encore bougie " + "cire " * 30},
+        ])
+        results = SearchEngine().keyword_search("bougie", store, ["name", "description"])
+        assert [ordinal for ordinal, _ in results] == [1, 0, 2]
+        assert results[0][1] > results[1][1] > results[2][1] > 0
+
+    def test_fuzzy_search_tolerates_typos(self, store):
+        """Test recherche approximative par trigrammes (fautes de frappe)"""
+        results = SearchEngine().fuzzy_search("casqe bluetoth", store, "name")
+        assert results[0][0] == 0
+        assert SearchEngine().fuzzy_search("casqe bluetoth", store, "name", ordinals={1, 2}) == []
+
+        rescored = SearchEngine().fuzzy_search("casqe bluetoth", store, "name", rescore=True)
+        assert rescored[0][0] == 0 and rescored[0][1] > 0.8
+
+    def test_suggest_ranks_by_popularity(self):
+        """Test autocomplétion par préfixe, triée par popularité, depuis n'importe quel mot"""
+        store = ProductStore([
+            {"id": "a", "Name": "Casque Bluetooth", "Category": "Tech"},
+            {"id": "b", "Name": "Casque Bluetooth", "Category": "Tech"},
+            {"id": "c", "Name": "Casquette brodée", "Category": "Mode"},
+            {"id": "d", "Name": "Carte cadeau", "Category": "Papeterie"},
+        ])
+        engine = SearchEngine()
+        assert engine.suggest("cas", store) == ["Casque Bluetooth", "Casquette brodée"]
+        assert engine.suggest("BLUE", store) == ["Casque Bluetooth"]
+        assert engine.suggest("car", store, limit=1) == ["Carte cadeau"]
+        assert engine.suggest("carte c", store) == ["Carte cadeau"]
+        assert engine.suggest("te", store, field="category") == ["Tech"]
+        assert engine.suggest("xyz", store) == []
+
+    def test_spelling_index(self, store):
+        """Test dictionnaire de corrections: distance d'édition et mots connus"""
+        index = store.spelling_index(["name", "description"])
+        assert index.lookup("bluetoth") == "bluetooth"
+        assert index.lookup("chocolta") == "chocolat"
+        assert index.lookup("casque") == "casque"
+        assert index.lookup("xylophone") is None
+        assert store.spelling_index(["Description", "Name"]) is index
+
+    def test_correct_query(self, store):
+        """Test correction de requête: seuls les mots inconnus de l'index sont corrigés"""
+        engine = SearchEngine()
+        corrected, corrections = engine.correct_query("casque bluetoth", store, ["name", "description"])
+        assert corrected == "casque bluetooth"
+        assert corrections == {"bluetoth": "bluetooth"}
+        assert engine.correct_query("casques pour la musique", store, ["name"]) == ("casques pour la musique", {})
+
+    def test_combined_search_with_filters(self, store):
+        """Test recherche combinée avec filtres de prix"""
+        items, total = SearchEngine().combined_search(
+            "casque", store, {"price_min": 50, "search_fields": ["name", "description"]}
+        )
+        assert [item["id"] for item in items] == ["rec1"]
+        assert total == 1
+
+    def test_combined_search_with_category_and_tags(self, store):
+        """Test recherche combinée avec catégories et étiquettes (bitmaps intersectés)"""
+        engine = SearchEngine()
+        filters = {"categories": ["cuisine"], "tags": ["Noël"], "search_fields": ["name", "description"]}
+        items, total = engine.combined_search("recettes chocolat", store, filters)
+        assert [item["id"] for item in items] == ["rec3"] and total == 1
+        assert engine.combined_search("casque", store, dict(filters, tags=["luxe"])) == ([], 0)
+
+    def test_facet_counts(self, store):
+        """Test facettes: une facette ignore son propre filtre, pas les autres"""
+        engine = SearchEngine()
+        fields = ["name", "description", "category"]
+        facets = engine.facet_counts("casque chocolat cuisine", store, {"search_fields": fields})
+        assert facets["categories"] == [{"value": "Cuisine", "count": 2}, {"value": "Tech", "count": 1}]
+        assert [bucket["count"] for bucket in facets["prices"]] == [1, 1, 1, 0]
+        assert facets["tags"] == [{"value": "Noël", "count": 2}, {"value": "Adulte", "count": 1}]
+
+        filtered = engine.facet_counts("casque chocolat cuisine", store,
+                                       {"categories": ["tech"], "price_max": 50, "search_fields": fields})
+        assert filtered["categories"] == [{"value": "Cuisine", "count": 2}]
+        assert [bucket["count"] for bucket in filtered["prices"]] == [0, 0, 1, 0]
+        assert filtered["tags"] == []
+
+    def test_min_hits_bitmap(self, store):
+        """Test bitmap des produits contenant au moins n mots de la requête"""
+        index = store.inverted_index(["name", "description"])
+        tokens = store.analyzer.analyze("chocolat quebec recettes")
+        assert bitmap.to_ordinals(index.bitmap(tokens)) == [1, 2]
+        assert bitmap.to_ordinals(index.bitmap(tokens, min_hits=2)) == [1]
+        assert index.bitmap(tokens, min_hits=3) == bitmap.EMPTY
+        cached = index.get_stats()["bitmaps"]
+        assert index.bitmap(["motinconnu", "autremot"]) == bitmap.EMPTY
+        assert index.get_stats()["bitmaps"] == cached
+
+    def test_combined_search_pagination(self, store):
+        """Test pagination poussée dans la recherche: seule la page est triée"""
+        engine = SearchEngine()
+        ranked = [ordinal for ordinal, _ in engine.keyword_search("recettes chocolat cuisine", store,
+                                                                  ["name", "description", "category"])]
+        filters = {"search_fields": ["name", "description", "category"]}
+
+        page, total = engine.combined_search("recettes chocolat cuisine", store, filters, skip=1, limit=1)
+        assert total == len(ranked) == 2
+        assert [item["id"] for item in page] == [PRODUCTS[ranked[1]]["id"]]
+        assert engine.combined_search("recettes chocolat cuisine", store, filters, skip=5, limit=3) == ([], 2)
+
+    def test_generations(self, store):
+        """Test générations: une par version du catalogue, publiée une fois construite"""
+        engine = SearchEngine()
+        assert engine.generation is None and engine.get_stats() == {"generation": 0}
+
+        first = engine.use(store)
+        assert engine.use(store) is first and first.number == 1
+        assert first.memory_bytes > 0 and first.get_stats()["indexes"]
+        assert any("deletions" in index for index in first.get_stats()["indexes"])  # correction prête
+
+        newer = ProductStore(PRODUCTS[:2], version=2)
+        second = engine.use(newer)
+        assert second.number == 2 and second.store is newer
+        assert engine.use(store) is second  # un catalogue plus ancien ne revient pas en arrière
+        assert engine.get_stats()["catalog_version"] == 2
+
+    def test_category_search(self, store):
+        """Test filtre par catégorie"""
+        assert SearchEngine().category_search(store, ["tech"]) == [0, 3]
+        assert SearchEngine().category_search(store, ["Cuisine"]) == [1, 2]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])